@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 import os
 import csv
+import threading
 import time
 from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import tiktoken
 import google.generativeai as genai
+from google.generativeai import client as genai_client
 import AI_Model_Files.config as config
 import pandas as pd
-import glob
+import image_source as isrc
+import image_integrity as integ
 
 # === INITIALIZE API‑KEY ROTATION & TOKENIZER ===
 api_key_index = 0
@@ -21,8 +24,9 @@ api_key_index += 1
 # Prepare tokenizer
 encoder = tiktoken.get_encoding(config.TOKENIZER_NAME)
 
-# Pre‑instantiate vision‑enabled models
-models = [genai.GenerativeModel(model_name=m) for m in config.VISION_MODELS]
+# Vision‑enabled models, one per (model name, API key index), created on first use
+keyed_models = {}
+keyed_models_lock = threading.Lock()
 
 def has_correct_header(csv_path, expected_columns):
     try:
@@ -41,39 +45,60 @@ def build_prompt(title, category, price):
         price=price
     )
 
-def call_generate(model, img_bytes, prompt):
+def model_for_key(model_name, key_idx):
     """
-    Select the next API key by index, reconfigure the SDK, then call.
+    The model `model_name` with its own client for API key `key_idx`. genai.configure()
+    sets the key for the whole process, so a run on another thread could switch it
+    before a request is sent; a client keeps the key it was created with.
+    """
+    with keyed_models_lock:
+        model = keyed_models.get((model_name, key_idx))
+        if model is None:
+            genai.configure(api_key=config.API_KEYS[key_idx])
+            model = genai.GenerativeModel(model_name=model_name)
+            # Created now, under the key just configured, instead of on the first request
+            model._client = genai_client.get_default_generative_client()
+            keyed_models[(model_name, key_idx)] = model
+        return model
+
+def call_generate(model_name, img_bytes, prompt, key_idx=None):
+    """
+    Send the request with the given API key (by default the next one by index).
     """
     global api_key_index
-    key_idx = api_key_index % num_keys
-    key = config.API_KEYS[key_idx]
-    genai.configure(api_key=key)
-    api_key_index += 1
+    if key_idx is None:
+        key_idx = api_key_index % num_keys
+        api_key_index += 1
+    model = model_for_key(model_name, key_idx)
 
     return model.generate_content(
         contents=[
-            {"mime_type": "image/jpeg", "data": img_bytes},
+            {"mime_type": integ.mime_type(img_bytes), "data": img_bytes},
             {"text": prompt}
         ]
     )
 
-def run_model(input_csv: str, image_folder: str, output_path: str, max_to_process: int = None):
-    config.INPUT_CSV = input_csv
-    config.PHOTO_DIR = image_folder
-    config.OUTPUT_CSV = output_path
-    config.MAX_TO_PROCESS = max_to_process
-
+def run_model(input_csv: str, image_folder: str, output_path: str, max_to_process: int = None, progress=None, acquire=None, exclude=None, extensions=None):
+    # image_folder may also be a ZIP of the images, which is read without extracting it
+    # progress, if given, is called as progress(event, **info) for every listing (see model_runs.py)
+    # acquire, if given, blocks before every API request and returns the key to use; it replaces the fixed delay
+    # exclude is a set of image names (as resolved in image_folder) found unusable at upload; their listings are skipped
+    # extensions limits the images found in image_folder, e.g. to the ones the upload was matched against
+    # The settings are passed down rather than set on config: several runs share this process
     print("Function main being called")
-    main()  # run main function
+    main(input_csv, image_folder, output_path, max_to_process,
+         progress=progress, acquire=acquire, exclude=exclude, extensions=extensions)  # run main function
     
     print("Run Model completed successfully!")
 
-def main():
+def main(input_csv, image_folder, output_path, max_to_process=None, progress=None, acquire=None, exclude=None, extensions=None):
     print("Function main called and starting")
 
-    output_filename = config.OUTPUT_CSV
-    input_filename = config.INPUT_CSV
+    if progress is None:
+        progress = lambda event, **info: None
+
+    output_filename = output_path
+    input_filename = input_csv
     print("Reading from:", output_filename)
 
     # Load input CSV
@@ -102,12 +127,19 @@ def main():
     df_to_process = df_input[~df_input['listing_url'].isin(processed_ids)].copy()
 
     print(f"🔁 Skipping {len(processed_ids)} already-labeled rows. {len(df_to_process)} remaining.")
+    if max_to_process is not None:
+        progress("start", total=min(max_to_process, len(df_to_process)))
+    else:
+        progress("start", total=len(df_to_process))
+
+    # Index the image folder (or ZIP) once instead of globbing it for every listing
+    images = isrc.get_source(image_folder, extensions=extensions)
 
     processed_rows = 0
     executor = ThreadPoolExecutor(max_workers=1)
 
     for idx, row in df_to_process.iterrows():
-        if config.MAX_TO_PROCESS is not None and processed_rows >= config.MAX_TO_PROCESS:
+        if max_to_process is not None and processed_rows >= max_to_process:
             break
 
         title     = row.get('title', '').strip()
@@ -116,37 +148,40 @@ def main():
         photo_url = row.get('photo_url', '').strip()
 
         basename = os.path.basename(photo_url)
-        search_pattern = os.path.join(config.PHOTO_DIR, '**', basename)
-        matches = glob.glob(search_pattern, recursive=True)
+        img_path = images.resolve(photo_url)
 
-        if not matches:
+        if img_path is None:
             print(f"[{processed_rows+1}] ⚠️  Skipping—no file for {basename}")
+            progress("skipped", photo_url=photo_url, reason="no image")
             continue
-
-        img_path = matches[0]  # Use the first match found
-        idx = processed_rows % len(models)
-        model = models[idx]
+        if exclude and img_path in exclude:
+            print(f"[{processed_rows+1}] ⚠️  Skipping—unusable image {basename}")
+            progress("skipped", photo_url=photo_url, reason="unusable image")
+            continue
+        idx = processed_rows % len(config.VISION_MODELS)
         model_name = config.VISION_MODELS[idx]
         prompt = build_prompt(title, category, price)
         prompt_tokens = len(encoder.encode(prompt))
 
-        # Compute which key index will be used next
-        upcoming_key_idx = api_key_index % num_keys
-
-        # LOGGING: include API‑key index
-        print(
-            f"[{processed_rows+1}] → Using {model_name} "
-            f"(prompt tokens: {prompt_tokens}) "
-            f"[API key index: {upcoming_key_idx}]"
-        )
-
-        with open(img_path, 'rb') as f:
-            img_bytes = f.read()
+        img_bytes = images.read(img_path)
 
         # API call with timeout retry
         resp = None
         for attempt in range(3):
-            future = executor.submit(call_generate, model, img_bytes, prompt)
+            # When run from the page, the shared scheduler decides when the request is sent and with which key
+            key_idx = acquire() if acquire is not None else None
+
+            # Compute which key index will be used next
+            upcoming_key_idx = key_idx if key_idx is not None else api_key_index % num_keys
+
+            # LOGGING: include API‑key index
+            print(
+                f"[{processed_rows+1}] → Using {model_name} "
+                f"(prompt tokens: {prompt_tokens}) "
+                f"[API key index: {upcoming_key_idx}]"
+            )
+
+            future = executor.submit(call_generate, model_name, img_bytes, prompt, key_idx)
             try:
                 resp = future.result(timeout=120)
                 break
@@ -160,6 +195,7 @@ def main():
 
         if not resp:
             print("    ❌ All retries failed; skipping this listing.")
+            progress("failed", photo_url=photo_url, reason="no response from the model")
             continue
 
         output = resp.text.strip()
@@ -216,12 +252,14 @@ def main():
         # Append single row to CSV
         pd.DataFrame([full_row]).to_csv(output_filename, mode='a', index=False, header=False)
         processed_rows += 1
+        progress("done", row=full_row)
 
-        time.sleep(config.DELAY_SECONDS)
+        if acquire is None:
+            time.sleep(config.DELAY_SECONDS)
 
     executor.shutdown()
 
     print(f"\n✅ Done! Processed {processed_rows} listings. Output → {output_filename}")
 
 if __name__ == "__main__":
-    main()
+    main(config.INPUT_CSV, config.PHOTO_DIR, config.OUTPUT_CSV, config.MAX_TO_PROCESS)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# storage_formats.py
+# -----------
+# Compares the formats drive_utils can store labeled datasets in: bytes sent to
+# Drive, time to serialize before an upload and time to parse after a download.
+# Runs offline on the National_Coverage dataset and on a synthetic dataset of
+# 500k rows drawn from it with fresh IDs. Titles, prices and locations still
+# come from the 5k real listings, so compressed sizes there lean optimistic.
+#
+#   python benchmarks/storage_formats.py [--rows 500000] [--repeat 3]
+
+import argparse
+import io
+import os
+import random
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import drive_utils as du
+
+NATIONAL_CSV = os.path.join("Data", "2025_07_24", "National_Coverage.csv")
+FORMATS = ["csv", "csv.gz", "parquet", "feather"]
+
+
+def labeled_dataset(csv_path):
+    # Same shape as the dataset the labeling pages save: original columns plus label columns
+    df = pd.read_csv(csv_path)
+    labeled = np.arange(len(df)) % 3 == 0
+    df["user_name"] = pd.Series(np.where(labeled, "labeler", None), dtype="string")
+    df["binary_flag"] = pd.Series(np.where(labeled, np.where(np.arange(len(df)) % 2 == 0, "Yes", "No"), None), dtype="string")
+    df["timestamp"] = pd.Series(np.where(labeled, "2025-07-24T12:00:00", None), dtype="string")
+    df["image_exist"] = True
+    return df
+
+
+# Listing IDs, photo IDs and hashes: the part of a listing that never repeats
+ID_PATTERN = r"[0-9a-f]{32}|\d{6,}"
+
+
+def synthetic_dataset(base, rows, seed=0):
+    # Rows are drawn from the base at random and every ID in them is replaced by random
+    # digits, so the copy compresses like new listings rather than like repeats of old ones
+    rng = np.random.default_rng(seed)
+    df = base.iloc[rng.integers(0, len(base), size=rows)].reset_index(drop=True)
+    id_rng = random.Random(seed)
+
+    def new_id(match):
+        length = len(match.group())
+        return f"{id_rng.randrange(10 ** length):0{length}d}"
+
+    pattern = re.compile(ID_PATTERN)
+    for col in df.columns:
+        if pd.api.types.is_string_dtype(df[col]) and df[col].str.contains(pattern, na=False).any():
+            df[col] = df[col].str.replace(pattern, new_id, regex=True)
+    return df
+
+
+def measure(df, file_format, repeat):
+    write_times, read_times = [], []
+    for _ in range(repeat):
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        du.serialize_dataframe(df, file_format, buffer)
+        write_times.append(time.perf_counter() - start)
+
+        size = buffer.tell()
+        buffer.seek(0)
+        start = time.perf_counter()
+        du.read_dataframe(buffer, file_format)
+        read_times.append(time.perf_counter() - start)
+    return size, min(write_times), min(read_times)
+
+
+def report(name, df, repeat):
+    print(f"\n{name}: {len(df):,} rows x {len(df.columns)} columns")
+    print(f"{'format':<10}{'size (MB)':>12}{'vs csv':>9}{'write (s)':>12}{'parse (s)':>12}{'vs csv':>9}")
+    baseline = None
+    for file_format in FORMATS:
+        size, write_s, read_s = measure(df, file_format, repeat)
+        if baseline is None:
+            baseline = (size, read_s)
+        print(
+            f"{file_format:<10}{size / 1e6:>12.2f}{size / baseline[0]:>9.0%}"
+            f"{write_s:>12.3f}{read_s:>12.3f}{read_s / baseline[1]:>9.0%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dataset storage formats")
+    parser.add_argument("--rows", type=int, default=500_000, help="rows in the synthetic dataset")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    national = labeled_dataset(NATIONAL_CSV)
+    report("National_Coverage", national, args.repeat)
+    report("Synthetic", synthetic_dataset(national, args.rows), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# csv_validation.py
+# -----------
+# Validation of uploaded CSVs without parsing the whole file first. The header
+# is checked on its own, so a file missing required columns is rejected after
+# reading one line; the rows are then streamed in chunks of CHUNK_ROWS, reading
+# only the columns that are checked:
+#
+#   price        "$1,200.00", "950" or "Free"
+#   photo_url    not empty
+#   listing_url  not repeated in the file
+#
+# Problems are reported with the row number a spreadsheet shows for them (the
+# header is row 1). Only the first MAX_ISSUES are kept; all are counted.
+#
+#   report = validate(uploaded_file, required_columns={"photo_url", "price"})
+#   report["missing_columns"], report["rows"], report["issues"], report["error"]
+
+import csv
+import os
+import numpy as np
+import pandas as pd
+
+CHUNK_ROWS = 100_000
+MAX_ISSUES = 200
+CHECKED_COLUMNS = ["price", "photo_url", "listing_url"]
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+
+
+def read_header(source):
+    """Column names from the first line of `source`, a path or an open binary file."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline="", encoding="utf-8-sig") as f:
+            line = f.readline()
+    else:
+        _rewind(source)
+        line = source.readline()
+        _rewind(source)
+        if isinstance(line, bytes):
+            line = line.decode("utf-8-sig")
+    return next(csv.reader([line]), [])
+
+
+# What the labeling page can display: "Free", or a number with optional "$" and thousands separators
+PRICE_PATTERN = r"free|\$?\s*-?(?:\d[\d,]*)?\.?\d+"
+
+
+def _price_issues(prices):
+    text = prices.str.strip()
+    missing = (text.isna() | text.eq("")).fillna(True).to_numpy(dtype=bool)
+    parseable = text.str.fullmatch(PRICE_PATTERN, case=False).fillna(False).to_numpy(dtype=bool)
+    return missing, ~parseable & ~missing
+
+
+def validate(source, required_columns=(), keep=()):
+    """
+    Check the header of `source` against `required_columns`, then stream its rows
+    through the checks above. Columns listed in `keep` are returned in report["values"].
+    """
+    report = {
+        "columns": [], "missing_columns": [], "rows": 0,
+        "issues": [], "issue_count": 0, "error": None, "values": None,
+    }
+
+    def add(rows, column, problem, values=None):
+        # Messages are only formatted for the issues that are kept
+        report["issue_count"] += len(rows)
+        room = max(MAX_ISSUES - len(report["issues"]), 0)
+        values = values[:room] if values is not None else [None] * min(room, len(rows))
+        for row, value in zip(rows[:room], values):
+            report["issues"].append({"row": int(row), "column": column, "problem": problem.format(value)})
+
+    try:
+        columns = read_header(source)
+    except (OSError, UnicodeDecodeError) as e:
+        report["error"] = f"Could not read the header: {e}"
+        return report
+    if not any(col.strip() for col in columns):
+        report["error"] = "The file is empty or has no header row."
+        return report
+    report["columns"] = columns
+    report["missing_columns"] = sorted(set(required_columns) - set(columns))
+    if report["missing_columns"]:
+        return report
+
+    usecols = [col for col in dict.fromkeys([*CHECKED_COLUMNS, *keep]) if col in columns]
+    kept = []
+    # Hashes of every listing_url and their rows, checked for repeats once the file is read
+    url_hashes, url_rows = [], []
+    try:
+        _rewind(source)
+        reader = pd.read_csv(source, usecols=usecols or [0], dtype=str, chunksize=CHUNK_ROWS)
+        for chunk in reader:
+            # Data row i sits on spreadsheet row i + 2, after the header
+            rows = (chunk.index + 2).to_numpy()
+            report["rows"] += len(chunk)
+
+            if "price" in chunk.columns:
+                missing, unparseable = _price_issues(chunk["price"])
+                add(rows[missing], "price", "missing price")
+                add(rows[unparseable], "price", "price is not a number: {!r}", chunk["price"][unparseable].tolist())
+
+            if "photo_url" in chunk.columns:
+                empty = chunk["photo_url"].isna() | chunk["photo_url"].str.strip().eq("").fillna(False)
+                add(rows[empty.to_numpy()], "photo_url", "missing photo_url")
+
+            if "listing_url" in chunk.columns:
+                present = chunk["listing_url"].notna()
+                url_hashes.append(pd.util.hash_pandas_object(chunk["listing_url"][present], index=False).to_numpy())
+                url_rows.append(rows[present.to_numpy()])
+
+            if keep:
+                kept.append(chunk[[col for col in keep if col in chunk.columns]])
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError, ValueError) as e:
+        report["error"] = f"Could not parse the file after row {report['rows'] + 1}: {e}"
+    finally:
+        _rewind(source)
+
+    if url_hashes:
+        rows = pd.Series(np.concatenate(url_rows))
+        hashes = np.concatenate(url_hashes)
+        first = rows.groupby(hashes, sort=False).transform("min")
+        duplicate = (first < rows).to_numpy()
+        add(rows.to_numpy()[duplicate], "listing_url", "duplicate of row {}", first[duplicate].tolist())
+
+    if keep:
+        report["values"] = pd.concat(kept) if kept else pd.DataFrame(columns=[col for col in keep if col in columns])
+    return report
+
+
+def issues_frame(report):
+    """The kept issues as a DataFrame for display."""
+    return pd.DataFrame(report["issues"], columns=["row", "column", "problem"])
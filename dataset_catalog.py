@@ -0,0 +1,290 @@
+# dataset_catalog.py
+# -----------
+# Persisted catalog of the datasets under Data/, so the dataset list renders
+# without touching Drive or re-reading any CSV. One entry per dataset holds its
+# paths, Drive IDs, counts and revision stamps:
+#
+#   {
+#     "key": "2025_07_24/National_Coverage.csv",
+#     "folder_name": "2025_07_24", "file": "National_Coverage.csv",
+#     "csv_path": ..., "images_folder": ..., "location": ..., "range": ..., "date": ...,
+#     "csv_stamp": [mtime_ns, size], "images_stamp": [mtime_ns, size],
+#     "drive_folder_id": ..., "stored_file": ..., "stored_file_id": ..., "stored_format": ...,
+#     "total": 4981, "labeled": 250, "revision": 3, "updated_at": "2025-07-24T12:00:00"
+#   }
+#
+# Entries are rebuilt only when their CSV or images folder changes on disk, and
+# are updated in place whenever labels are saved through save_labels().
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+import pandas as pd
+from googleapiclient.errors import HttpError
+import drive_utils as du
+import image_index as ii
+
+DATASETS_DIR = os.path.join(os.getcwd(), "Data")
+CATALOG_PATH = os.path.join(os.getcwd(), ".cache", "dataset_catalog.json")
+
+LABEL_COLUMNS = ["user_name", "binary_flag", "timestamp"]
+
+# Datasets rebuilt in parallel during a refresh (kept below drive_utils.POOL_SIZE)
+SCAN_WORKERS = 4
+
+_lock = threading.RLock()
+_catalog = None
+
+# --- Persistence ---
+def _load_catalog():
+    global _catalog
+    if _catalog is None:
+        try:
+            with open(CATALOG_PATH) as f:
+                _catalog = json.load(f)
+        except (OSError, ValueError):
+            _catalog = {}
+    return _catalog
+
+def _save_catalog():
+    os.makedirs(os.path.dirname(CATALOG_PATH), exist_ok=True)
+    tmp_path = f"{CATALOG_PATH}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(_catalog, f, indent=1)
+    os.replace(tmp_path, CATALOG_PATH)
+
+def get_entry(key):
+    with _lock:
+        entry = _load_catalog().get(key)
+        return dict(entry) if entry else None
+
+# --- Local data folder ---
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def parse_dataset_name(file):
+    # New logic to support merged/national datasets
+    location_parts = file.replace(".csv", "").split("_")
+
+    if len(location_parts) >= 3 and location_parts[-1].endswith("mi"):
+        # Standard city_state_miles format
+        return " ".join(location_parts[:-1]).title(), location_parts[-1]
+    # Fallback for merged or national datasets
+    return " ".join(location_parts).title(), "Merged"
+
+def scan_data_folder(datasets_dir=DATASETS_DIR):
+    """Every dataset CSV under Data/<date>/ that has an images folder, newest date first. Only stat() calls."""
+    found = {}
+    if not os.path.exists(datasets_dir):
+        return found
+
+    for folder_name in sorted(os.listdir(datasets_dir), reverse=True):
+        if not folder_name.startswith("20"):
+            continue
+
+        folder_path = os.path.join(datasets_dir, folder_name)
+        if not os.path.isdir(folder_path):
+            continue
+
+        for file in sorted(os.listdir(folder_path)):
+            # Skip dataset if its images folder doesn't exist
+            images_folder = os.path.join(folder_path, file.replace(".csv", "_files"))
+            if not file.endswith(".csv") or not os.path.exists(images_folder):
+                continue
+
+            csv_path = os.path.join(folder_path, file)
+            location, range_miles = parse_dataset_name(file)
+            key = f"{folder_name}/{file}"
+            found[key] = {
+                "key": key,
+                "folder_name": folder_name,
+                "file": file,
+                "csv_path": csv_path,
+                "images_folder": images_folder,
+                "location": location,
+                "range": range_miles,
+                "date": folder_name.replace("_", "/"),
+                "csv_stamp": _stamp(csv_path),
+                "images_stamp": _stamp(images_folder),
+            }
+    return found
+
+# --- Dataset frames ---
+def _record_stored(key, stored):
+    # Point an entry at the labeled copy found on Drive now (or at none), keeping its revision
+    with _lock:
+        catalog = _load_catalog()
+        if key not in catalog:
+            return
+        catalog[key] = dict(
+            catalog[key],
+            stored_file=stored[0] if stored else None,
+            stored_file_id=stored[1] if stored else None,
+            stored_format=stored[2] if stored else None,
+        )
+        _save_catalog()
+
+def _load_stored(entry):
+    stored = (entry["stored_file"], entry["stored_file_id"], entry["stored_format"])
+    try:
+        return du.load_dataset(entry["file"], entry["drive_folder_id"], stored=stored)
+    except HttpError as e:
+        if e.resp.status != 404:
+            raise
+    # Deleted or replaced on Drive since the catalog saw it: look the labeled copy up again
+    print(f"Labeled copy {entry['stored_file']} of {entry['file']} is gone from Drive, looking it up again")
+    dataset = (entry["file"], entry["drive_folder_id"])
+    stored = du.resolve_datasets([dataset])[dataset]
+    _record_stored(entry.get("key"), stored)
+    if stored is None:
+        return pd.DataFrame()
+    return du.load_dataset(entry["file"], entry["drive_folder_id"], stored=stored)
+
+def load_frame(entry):
+    """
+    The labeling frame for a catalog entry: the labeled copy from Drive when there is
+    one, otherwise the local CSV with empty label columns. image_exist is recomputed
+    against the images folder either way.
+    """
+    df = None
+    if entry.get("stored_file_id"):
+        labeled_df = _load_stored(entry)
+        df = labeled_df.copy() if not labeled_df.empty else None
+
+    if df is None:
+        df = pd.read_csv(entry["csv_path"])
+        for col in LABEL_COLUMNS:
+            df[col] = pd.Series([pd.NA] * len(df), dtype="string")
+    else:
+        # Ensure required columns exist
+        for col in LABEL_COLUMNS:
+            if col not in df.columns:
+                df[col] = pd.Series([pd.NA] * len(df), dtype="string")
+
+    df['image_exist'] = ii.get_index(entry["images_folder"]).exists(df['photo_url'])
+    return df
+
+def count_labels(df):
+    with_image = df['image_exist'] == True
+    total = int(with_image.sum())
+    labeled = int((df['binary_flag'].notna() & with_image).sum()) if 'binary_flag' in df.columns else 0
+    return total, labeled
+
+# --- Catalog updates ---
+def _updated(entry, previous, **changes):
+    entry = dict(entry)
+    entry.update(changes)
+    entry["revision"] = (previous or {}).get("revision", 0) + 1
+    entry["updated_at"] = datetime.now().isoformat()
+    return entry
+
+def _build_entry(local, drive_folder_id, stored, previous):
+    entry = dict(local)
+    entry.update({
+        "drive_folder_id": drive_folder_id,
+        "stored_file": stored[0] if stored else None,
+        "stored_file_id": stored[1] if stored else None,
+        "stored_format": stored[2] if stored else None,
+    })
+    total, labeled = count_labels(load_frame(entry))
+    return _updated(entry, previous, total=total, labeled=labeled)
+
+def iter_refresh(root_folder_id, force=False, local=None):
+    """
+    Bring the catalog in line with Data/, yielding entries as they become ready:
+    up-to-date entries at once, then stale ones (new, or whose CSV or images folder
+    changed; every one with force=True) as soon as their rebuild finishes. Rebuilds
+    (Drive download, image indexing, counts) run on a pool of SCAN_WORKERS threads.
+    """
+    if local is None:
+        local = scan_data_folder()
+    with _lock:
+        catalog = _load_catalog()
+        stale = [
+            dataset for key, dataset in local.items()
+            if force
+            or key not in catalog
+            or catalog[key]["csv_stamp"] != dataset["csv_stamp"]
+            or catalog[key]["images_stamp"] != dataset["images_stamp"]
+        ]
+        stale_keys = {dataset["key"] for dataset in stale}
+        removed = [key for key in catalog if key not in local]
+        fresh = [dict(catalog[key]) for key in local if key not in stale_keys]
+
+    yield from fresh
+
+    try:
+        if stale:
+            # One batch resolves (or creates) every date folder, a second finds every labeled dataset
+            folder_ids = du.batch_resolve_folder_ids(sorted({d["folder_name"] for d in stale}), root_folder_id)
+            for folder_name, folder_id in folder_ids.items():
+                if not folder_id:
+                    folder_ids[folder_name] = du.create_drive_folder(folder_name, root_folder_id)
+            stored = du.resolve_datasets([(d["file"], folder_ids[d["folder_name"]]) for d in stale])
+
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+                futures = {}
+                for dataset in stale:
+                    drive_folder_id = folder_ids[dataset["folder_name"]]
+                    future = executor.submit(
+                        _build_entry,
+                        dataset,
+                        drive_folder_id,
+                        stored.get((dataset["file"], drive_folder_id)),
+                        get_entry(dataset["key"])
+                    )
+                    futures[future] = dataset["key"]
+
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        entry = future.result()
+                    except Exception as e:
+                        print(f"Could not build catalog entry for {key}: {e}")
+                        continue
+                    with _lock:
+                        _load_catalog()[key] = entry
+                    yield dict(entry)
+    finally:
+        # Persist whatever finished, even if the caller stopped iterating early
+        with _lock:
+            catalog = _load_catalog()
+            for key in removed:
+                catalog.pop(key, None)
+            if stale or removed:
+                _save_catalog()
+
+def refresh_catalog(root_folder_id, force=False):
+    """Refresh the catalog and return its entries in display order (newest date first)."""
+    local = scan_data_folder()
+    entries = {entry["key"]: entry for entry in iter_refresh(root_folder_id, force=force, local=local)}
+    return [entries[key] for key in local if key in entries]
+
+def record_save(key, df, stored_file, stored_file_id):
+    """Update an entry after its labels were written to Drive."""
+    if key is None:
+        return
+    total, labeled = count_labels(df)
+    with _lock:
+        catalog = _load_catalog()
+        previous = catalog.get(key)
+        if previous is None:
+            return
+        catalog[key] = _updated(
+            previous, previous,
+            total=total,
+            labeled=labeled,
+            stored_file=stored_file,
+            stored_file_id=stored_file_id,
+            stored_format=du.DATASET_FORMAT,
+        )
+        _save_catalog()
+
+def save_labels(df, sel):
+    """Save a labeled frame for the selected dataset to Drive and update its catalog entry."""
+    response = du.save_dataset(df, sel["drive_file"], sel["drive_folder_id"])
+    record_save(sel.get("catalog_key"), df, du.dataset_file_name(sel["drive_file"]), (response or {}).get("id"))
+    return response
@@ -0,0 +1,348 @@
+# dataset_store.py
+# -----------
+# Process-wide store of labeling frames, shared by every session. Each dataset
+# has one base frame per revision, treated as read-only; the least recently
+# used frames are evicted past MAX_DATASETS. A session never copies the base:
+# it keeps a small label overlay instead,
+#
+#   {(listing_url, photo_url): (binary_flag, user_name, timestamp), ...}
+#
+# which is merged in when reading counts and when saving. Each base comes with
+# a keyed index from (listing_url, photo_url) to its row, so an overlay is
+# applied with one vectorized lookup and still lands on the right rows if a
+# later revision orders them differently. A save merges the overlay onto the
+# latest base (so labels saved by other users are kept), uploads it and
+# publishes the result as the new base.
+#
+# The labeling page reads a LabelingView of the base, built once per revision:
+# its counts, the queue of unlabeled rows and every row's image path. Each
+# session walks that queue with a LabelQueue, which keeps its own running
+# count, so a rerun never scans the full frame.
+#
+# Reposts are labeled once: listings sharing an image_key or a listing_url
+# (and, with GROUP_BY_PERCEPTUAL_HASH, a near-identical image) form a group,
+# only its first unlabeled listing is queued, and its label is given to every
+# unlabeled listing of the group on submit.
+
+import gzip
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import dataset_catalog as dc
+import drive_utils as du
+import image_index as ii
+import thumbnails as th
+
+MAX_DATASETS = 4
+
+# Listings sharing a value in any of these columns are duplicates of each other
+DUPLICATE_KEYS = ["image_key", "listing_url"]
+# Also group listings whose images have the same perceptual hash (reads every image once)
+GROUP_BY_PERCEPTUAL_HASH = False
+
+# Order of the values in an overlay entry
+OVERLAY_COLUMNS = ["binary_flag", "user_name", "timestamp"]
+
+# Download exports are cached per dataset revision, up to this many bytes in total.
+# Datasets with more rows than LARGE_EXPORT_ROWS are exported gzip-compressed.
+MAX_EXPORT_BYTES = 64 * 1024 * 1024
+LARGE_EXPORT_ROWS = 100_000
+
+_lock = threading.Lock()
+_frames = OrderedDict()
+_dataset_locks = {}
+_exports = OrderedDict()
+
+
+def dataset_key(sel):
+    return sel.get("catalog_key") or f"{sel['drive_folder_id']}/{sel['drive_file']}"
+
+
+def _dataset_lock(key):
+    with _lock:
+        return _dataset_locks.setdefault(key, threading.RLock())
+
+
+def _entry_for(sel):
+    entry = dc.get_entry(sel.get("catalog_key"))
+    if entry is None:
+        # Not in the catalog (e.g. selected before it existed): find the stored copy directly
+        stored = du.resolve_datasets([(sel["drive_file"], sel["drive_folder_id"])])[(sel["drive_file"], sel["drive_folder_id"])]
+        entry = {
+            "file": sel["drive_file"],
+            "drive_folder_id": sel["drive_folder_id"],
+            "csv_path": sel["csv_path"],
+            "images_folder": sel["images_folder"],
+            "stored_file": stored[0] if stored else None,
+            "stored_file_id": stored[1] if stored else None,
+            "stored_format": stored[2] if stored else None,
+        }
+    return entry
+
+
+def _build_key_index(frame):
+    # The first row wins when a (listing_url, photo_url) pair appears more than once
+    keys = pd.MultiIndex.from_arrays([frame["listing_url"], frame["photo_url"]])
+    first = ~keys.duplicated()
+    return pd.Series(frame.index[first], index=keys[first])
+
+
+def _publish(key, revision, frame, keys=None):
+    if keys is None:
+        keys = _build_key_index(frame)
+    with _lock:
+        _frames[key] = {"revision": revision, "frame": frame, "keys": keys, "view": None}
+        _frames.move_to_end(key)
+        while len(_frames) > MAX_DATASETS:
+            _frames.popitem(last=False)
+
+
+def _cached(key, revision):
+    with _lock:
+        cached = _frames.get(key)
+        if cached is not None and cached["revision"] == revision:
+            _frames.move_to_end(key)
+            return cached["frame"]
+    return None
+
+
+def _record_for(base):
+    with _lock:
+        for record in _frames.values():
+            if record["frame"] is base:
+                return record
+    return None
+
+
+def key_index(base):
+    """Series from (listing_url, photo_url) to the row label in `base`, built once per published frame."""
+    record = _record_for(base)
+    return record["keys"] if record else _build_key_index(base)
+
+
+def _positions(keys, pairs):
+    return keys.index.get_indexer(pd.MultiIndex.from_tuples(list(pairs), names=keys.index.names))
+
+
+def locate(base, pairs):
+    """Row labels of `base` for (listing_url, photo_url) pairs; pairs not in the dataset are skipped."""
+    if not pairs:
+        return base.index[:0]
+    keys = key_index(base)
+    positions = _positions(keys, pairs)
+    return pd.Index(keys.to_numpy()[positions[positions >= 0]])
+
+
+def get_base(sel):
+    """Shared frame of the selected dataset at its latest revision. Do not modify it."""
+    key = dataset_key(sel)
+    entry = _entry_for(sel)
+    revision = entry.get("revision")
+
+    frame = _cached(key, revision)
+    if frame is not None:
+        return frame
+
+    # Only one session loads a given dataset; the others wait and reuse it
+    with _dataset_lock(key):
+        frame = _cached(key, revision)
+        if frame is None:
+            frame = dc.load_frame(entry)
+            _publish(key, revision, frame)
+    return frame
+
+
+def apply_labels(base, overlay):
+    """New frame with the overlay's labels; only the label columns are copied."""
+    merged = base.copy(deep=False)
+    if not overlay:
+        return merged
+    keys = key_index(base)
+    positions = _positions(keys, overlay)
+    found = positions >= 0
+    rows = keys.to_numpy()[positions[found]]
+    labels = pd.DataFrame(list(overlay.values()), columns=OVERLAY_COLUMNS)[found]
+    for col in dc.LABEL_COLUMNS:
+        column = base[col].astype("string")
+        column.loc[rows] = labels[col].astype("string").to_numpy()
+        merged[col] = column
+    return merged
+
+
+def _duplicate_groups(columns, length):
+    """
+    Group of each row position: rows sharing a value in any of `columns` (missing
+    values never match) are connected, and every group is numbered by its first row.
+    """
+    group = np.arange(length)
+    codes = [pd.factorize(column)[0] for column in columns]
+    while True:
+        previous = group
+        for code in codes:
+            valid = code >= 0
+            group = group.copy()
+            group[valid] = pd.Series(group[valid]).groupby(code[valid]).transform("min").to_numpy()
+        if np.array_equal(group, previous):
+            return group
+
+
+class LabelingView:
+    """What the labeling page needs from one revision of a base frame, computed once."""
+
+    def __init__(self, frame, revision, images_folder):
+        with_image = (frame["image_exist"] == True).to_numpy()
+        unlabeled = with_image & frame["binary_flag"].isna().to_numpy()
+        self.frame = frame
+        self.revision = revision
+        self.total = int(with_image.sum())
+        self.labeled = self.total - int(unlabeled.sum())
+        self.image_paths = ii.get_index(images_folder).resolve_column(frame["photo_url"])
+
+        columns = [frame[col] for col in DUPLICATE_KEYS if col in frame.columns]
+        if GROUP_BY_PERCEPTUAL_HASH:
+            columns.append(self.image_paths.map(lambda path: th.perceptual_hash(path) if path else None))
+        groups = _duplicate_groups(columns, len(frame))
+        self.total_groups = len(np.unique(groups[with_image]))
+
+        # Row labels still to be labeled, in dataset order; only the first of each group is queued
+        self.unlabeled = frame.index.to_numpy()[unlabeled]
+        unlabeled_groups = groups[unlabeled]
+        first = ~pd.Index(unlabeled_groups).duplicated()
+        self.queue = self.unlabeled[first]
+        representative = pd.Series(self.queue, index=unlabeled_groups[first]).loc[unlabeled_groups].to_numpy()
+
+        # Unlabeled listings each queued row stands for, only kept for groups with duplicates
+        shared = pd.Index(representative).duplicated(keep=False)
+        members = pd.Series(self.unlabeled[shared]).groupby(representative[shared])
+        self._members = {rep: rows.to_numpy() for rep, rows in members}
+        self.duplicates = members.size() - 1
+
+    def page(self, rows):
+        """
+        The given rows, with their resolved image path as an image_path column and
+        the number of unlabeled duplicates each one stands for as a duplicates column.
+        """
+        page = self.frame.loc[rows].copy()
+        page["image_path"] = self.image_paths.loc[rows].to_numpy()
+        page["duplicates"] = self.duplicates.reindex(rows, fill_value=0).to_numpy()
+        return page
+
+    def members(self, rows):
+        """(queued row, listing it labels) pairs for `rows`, each row first followed by its duplicates."""
+        return [(row, member) for row in rows for member in self._members.get(row, (row,))]
+
+
+def get_view(sel):
+    """Shared LabelingView of the selected dataset at its latest revision."""
+    base = get_base(sel)
+    record = _record_for(base)
+    if record is None:
+        return LabelingView(base, _entry_for(sel).get("revision"), sel["images_folder"])
+    with _dataset_lock(dataset_key(sel)):
+        if record["view"] is None:
+            record["view"] = LabelingView(base, record["revision"], sel["images_folder"])
+    return record["view"]
+
+
+class LabelQueue:
+    """
+    One session's walk through a view's unlabeled queue. Rows already in the
+    session's overlay are dropped once, when the queue is built; after that rows
+    leave the queue by value when their page is submitted, so a queue rebuilt
+    for a new revision (another user saved) never serves a labeled page again.
+    """
+
+    def __init__(self, view, overlay, previous=None):
+        labeled_rows = locate(view.frame, overlay).to_numpy() if overlay else np.array([], dtype=view.queue.dtype)
+        pending = np.isin(view.queue, labeled_rows)
+        self.revision = view.revision
+        self.total = view.total
+        # Listings unlabeled in this revision and not yet labeled by the session
+        self._unlabeled = view.unlabeled[~np.isin(view.unlabeled, labeled_rows)]
+        self.labeled = view.total - len(self._unlabeled)
+        self.total_groups = view.total_groups
+        # Rows not submitted yet, in serving order
+        self.rows = view.queue[~pending]
+        self.labeled_groups = view.total_groups - len(self.rows)
+        self._dataset_order = self.rows
+        # What the rows are sorted by (None: dataset order) and the priority it was built from
+        self.order = None
+        self._priority = None
+        # A rebuilt queue keeps the session's chosen order
+        if previous is not None and previous.order is not None:
+            self.reorder(previous._priority, order=previous.order)
+
+    def next_page(self, size):
+        """Row labels of the next `size` queued rows."""
+        return list(self.rows[:size])
+
+    def remaining(self):
+        """Row labels not yet submitted, in serving order."""
+        return self.rows
+
+    def reorder(self, priority=None, order=None):
+        """
+        Serve the remaining rows by ascending `priority`, a Series indexed by row label
+        (rows without a priority go last, ties in dataset order), and record `order` as
+        the current ordering. With no priority the remaining rows go back to dataset order.
+        """
+        rest = self._dataset_order[np.isin(self._dataset_order, self.rows)]
+        if priority is not None:
+            keys = priority.reindex(rest).to_numpy(dtype=float, na_value=np.inf)
+            rest = rest[np.argsort(keys, kind="stable")]
+        self.rows = rest
+        self.order = order
+        self._priority = priority
+
+    def submitted(self, page_rows, listing_rows):
+        """
+        Take the submitted `page_rows` out of the queue. `listing_rows` are the listings
+        their labels went to; only those still unlabeled in this revision add to the count.
+        """
+        self.rows = self.rows[~np.isin(self.rows, page_rows)]
+        self.labeled_groups = self.total_groups - len(self.rows)
+        newly_labeled = np.isin(self._unlabeled, listing_rows)
+        self.labeled += int(newly_labeled.sum())
+        self._unlabeled = self._unlabeled[~newly_labeled]
+
+
+def save_labels(sel, overlay):
+    """Merge the overlay onto the latest base, upload it and make it the new shared base."""
+    key = dataset_key(sel)
+    with _dataset_lock(key):
+        base = get_base(sel)
+        merged = apply_labels(base, overlay)
+        dc.save_labels(merged, sel)
+        entry = dc.get_entry(sel.get("catalog_key"))
+        # Only label columns changed, so the rows keep their keys
+        _publish(key, entry.get("revision") if entry else None, merged, keys=key_index(base))
+    return merged
+
+
+def export_csv(sel, compressed=False):
+    """
+    CSV bytes (gzip-compressed if `compressed`) of the dataset's latest saved revision.
+    Built the first time a download is requested and cached until the next save.
+    """
+    key = dataset_key(sel)
+    revision = _entry_for(sel).get("revision")
+    export_key = (key, revision, compressed)
+
+    with _lock:
+        if export_key in _exports:
+            _exports.move_to_end(export_key)
+            return _exports[export_key]
+
+    data = get_base(sel).to_csv(index=False).encode("utf-8")
+    if compressed:
+        data = gzip.compress(data, compresslevel=6)
+
+    with _lock:
+        # Older revisions of this dataset will never be asked for again
+        for stale in [k for k in _exports if k[0] == key and k[1] != revision]:
+            del _exports[stale]
+        _exports[export_key] = data
+        while len(_exports) > 1 and sum(len(v) for v in _exports.values()) > MAX_EXPORT_BYTES:
+            _exports.popitem(last=False)
+    return data
@@ -1,20 +1,113 @@
 # drive_utils.py
 
 import io
+import os
 import pandas as pd
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+from googleapiclient.http import MediaIoBaseDownload, MediaIoBaseUpload
+import google_auth_httplib2
+import httplib2
 import streamlit as st
 import json
 import time
+import queue
+import tempfile
+import threading
+from contextlib import contextmanager
 from googleapiclient.errors import HttpError
 
 # --- Setup credentials from Streamlit secrets ---
-creds_dict = json.loads(st.secrets["GDRIVE_KEY"])
+# Credentials and Drive services are created lazily, on the first Drive call, so
+# importing this module from a page costs nothing.
 SCOPES = ['https://www.googleapis.com/auth/drive']
-credentials = service_account.Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
-drive_service = build('drive', 'v3', credentials=credentials)
+
+# Maximum number of Drive services (and HTTP connections) alive at once
+POOL_SIZE = 8
+
+# Drive's batch endpoint accepts at most 100 calls per request
+BATCH_LIMIT = 100
+RETRIABLE_STATUSES = {403, 429, 500, 502, 503, 504}
+
+# Uploads are serialized into a private spooled buffer: kept in memory up to
+# SPOOL_MAX_SIZE, then rolled over to an anonymous temp file, and sent to Drive
+# as a resumable upload in UPLOAD_CHUNK_SIZE pieces (a multiple of 256 KB).
+SPOOL_MAX_SIZE = 32 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_FORMATS = {
+    'csv': 'text/csv',
+    'csv.gz': 'application/gzip',
+    'parquet': 'application/vnd.apache.parquet',
+    'feather': 'application/vnd.apache.arrow.file',
+}
+FORMAT_EXTENSIONS = {
+    'csv': '.csv',
+    'csv.gz': '.csv.gz',
+    'parquet': '.parquet',
+    'feather': '.feather',
+}
+
+# Labeled datasets are stored on Drive in this format. CSV is only produced for
+# the "Download CSV" buttons; legacy CSV copies on Drive are still read (and
+# replaced by the columnar file on the next save).
+DATASET_FORMAT = 'parquet'
+
+_credentials = None
+_credentials_lock = threading.Lock()
+_service_factory = None
+_service_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+_service_slots = threading.BoundedSemaphore(POOL_SIZE)
+
+def get_credentials():
+    global _credentials
+    if _credentials is None:
+        with _credentials_lock:
+            if _credentials is None:
+                creds_dict = json.loads(st.secrets["GDRIVE_KEY"])
+                _credentials = service_account.Credentials.from_service_account_info(creds_dict, scopes=SCOPES)
+    return _credentials
+
+def _build_service():
+    if _service_factory is not None:
+        return _service_factory()
+
+    # Every service gets its own httplib2 transport: httplib2 is not thread-safe,
+    # so a service must only be used by one thread at a time.
+    http = google_auth_httplib2.AuthorizedHttp(get_credentials(), http=httplib2.Http())
+    return build('drive', 'v3', http=http, cache_discovery=False)
+
+@contextmanager
+def drive_client():
+    """
+    Check a Drive service out of the shared pool for the duration of the block.
+    Services are reused across calls (keeping their connections open) and at
+    most POOL_SIZE requests run concurrently across all sessions.
+    """
+    _service_slots.acquire()
+    try:
+        try:
+            service = _service_pool.get_nowait()
+        except queue.Empty:
+            service = _build_service()
+        try:
+            yield service
+        finally:
+            _service_pool.put_nowait(service)
+    finally:
+        _service_slots.release()
+
+def use_service_factory(factory):
+    """
+    Swap the backend behind drive_client(), e.g. fake_drive.FakeDrive().service to
+    run offline. Pass None to go back to Google Drive.
+    """
+    global _service_factory
+    _service_factory = factory
+    while True:
+        try:
+            _service_pool.get_nowait()
+        except queue.Empty:
+            break
 
 # --- Helper Functions ---
 def get_folder_id_by_name(folder_name, parent_id=None, retries=3, delay=2):
@@ -24,11 +117,12 @@ def get_folder_id_by_name(folder_name, parent_id=None, retries=3, delay=2):
 
     for attempt in range(retries):
         try:
-            results = drive_service.files().list(
-                q=query,
-                spaces='drive',
-                fields='files(id, name)'
-            ).execute()
+            with drive_client() as service:
+                results = service.files().list(
+                    q=query,
+                    spaces='drive',
+                    fields='files(id, name)'
+                ).execute()
 
             if isinstance(results, dict):
                 folders = results.get('files', [])
@@ -47,64 +141,267 @@ def create_drive_folder(folder_name, parent_id):
         'mimeType': 'application/vnd.google-apps.folder',
         'parents': [parent_id]
     }
-    folder = drive_service.files().create(body=file_metadata, fields='id').execute()
+    with drive_client() as service:
+        folder = service.files().create(body=file_metadata, fields='id').execute()
     return folder.get('id')
 
 def list_date_folders():
     root_id = get_folder_id_by_name("LabelingAppData")
-    results = drive_service.files().list(
-        q=f"'{root_id}' in parents and mimeType='application/vnd.google-apps.folder'",
-        fields="files(id, name)",
-    ).execute()
+    with drive_client() as service:
+        results = service.files().list(
+            q=f"'{root_id}' in parents and mimeType='application/vnd.google-apps.folder'",
+            fields="files(id, name)",
+        ).execute()
     return sorted(results.get('files', []), key=lambda x: x['name'], reverse=True)
 
 def list_csvs_in_folder(folder_id):
     query = f"'{folder_id}' in parents and name contains '.csv'"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
+    with drive_client() as service:
+        results = service.files().list(q=query, fields="files(id, name)").execute()
     return results.get('files', [])
 
 def get_file_id_by_name(name, folder_id):
     query = f"name='{name}' and '{folder_id}' in parents"
-    results = drive_service.files().list(q=query, fields="files(id, name)").execute()
+    with drive_client() as service:
+        results = service.files().list(q=query, fields="files(id, name)").execute()
     files = results.get('files', [])
     return files[0]['id'] if files else None
 
-def download_csv(file_name, folder_id):
-    file_id = get_file_id_by_name(file_name, folder_id)
+def read_dataframe(buffer, file_format='csv'):
+    if file_format == 'csv':
+        return pd.read_csv(buffer)
+    if file_format == 'csv.gz':
+        return pd.read_csv(buffer, compression='gzip')
+    if file_format == 'parquet':
+        return pd.read_parquet(buffer)
+    if file_format == 'feather':
+        return pd.read_feather(buffer)
+    raise ValueError(f"Unsupported file format: {file_format}")
+
+def download_dataframe(file_name, folder_id, file_format='csv', file_id=None):
+    if file_id is None:
+        file_id = get_file_id_by_name(file_name, folder_id)
     if file_id is None:
         return pd.DataFrame()
-    request = drive_service.files().get_media(fileId=file_id)
     fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while not done:
-        status, done = downloader.next_chunk()
+    with drive_client() as service:
+        request = service.files().get_media(fileId=file_id)
+        downloader = MediaIoBaseDownload(fh, request)
+        done = False
+        while not done:
+            status, done = downloader.next_chunk()
     fh.seek(0)
     try:
-        return pd.read_csv(fh)
+        return read_dataframe(fh, file_format)
     except Exception:
         return pd.DataFrame()
 
-def upload_csv(df, file_name, folder_id):
-    # Check if file exists
-    file_id = get_file_id_by_name(file_name, folder_id)
-    df.to_csv(file_name, index=False)
-    media = MediaFileUpload(file_name, mimetype='text/csv')
+def download_csv(file_name, folder_id, file_id=None):
+    return download_dataframe(file_name, folder_id, file_format='csv', file_id=file_id)
 
-    if file_id:
-        drive_service.files().update(fileId=file_id, media_body=media,supportsAllDrives=True).execute()
+def serialize_dataframe(df, file_format, buffer):
+    if file_format == 'csv':
+        df.to_csv(buffer, index=False)
+    elif file_format == 'csv.gz':
+        df.to_csv(buffer, index=False, compression='gzip')
+    elif file_format == 'parquet':
+        df.to_parquet(buffer, index=False, compression='zstd')
+    elif file_format == 'feather':
+        df.reset_index(drop=True).to_feather(buffer, compression='zstd')
     else:
-        drive_service.files().create(
-            body={'name': file_name, 'parents': [folder_id]},
-            media_body=media,
-            supportsAllDrives=True
-        ).execute()
+        raise ValueError(f"Unsupported file format: {file_format}")
+
+def upload_dataframe(df, file_name, folder_id, file_format='csv', file_id=None):
+    """
+    Upload `df` as `file_name`, replacing the file if it already exists.
+    file_format is one of UPLOAD_FORMATS. Nothing is written to the working directory.
+    """
+    if file_id is None:
+        file_id = get_file_id_by_name(file_name, folder_id)
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as buffer:
+        serialize_dataframe(df, file_format, buffer)
+        buffer.seek(0)
+        media = MediaIoBaseUpload(
+            buffer,
+            mimetype=UPLOAD_FORMATS[file_format],
+            chunksize=UPLOAD_CHUNK_SIZE,
+            resumable=True
+        )
+
+        with drive_client() as service:
+            if file_id:
+                request = service.files().update(fileId=file_id, media_body=media, supportsAllDrives=True)
+            else:
+                request = service.files().create(
+                    body={'name': file_name, 'parents': [folder_id]},
+                    media_body=media,
+                    supportsAllDrives=True
+                )
+            response = None
+            while response is None:
+                status, response = request.next_chunk(num_retries=3)
+    return response
+
+def upload_csv(df, file_name, folder_id, file_id=None):
+    return upload_dataframe(df, file_name, folder_id, file_format='csv', file_id=file_id)
+
+# --- Labeled Datasets ---
+def dataset_file_name(csv_name, file_format=DATASET_FORMAT):
+    """Name of the Drive copy of a local dataset CSV, e.g. National_Coverage.csv -> National_Coverage.parquet"""
+    return os.path.splitext(csv_name)[0] + FORMAT_EXTENSIONS[file_format]
+
+def resolve_datasets(datasets):
+    """
+    Find the labeled copy of many (csv_name, folder_id) datasets in one batch.
+    Returns {(csv_name, folder_id): (file_name, file_id, file_format) or None},
+    preferring the DATASET_FORMAT file over a legacy CSV.
+    """
+    candidates = []
+    for csv_name, folder_id in datasets:
+        candidates.append((dataset_file_name(csv_name), folder_id))
+        candidates.append((csv_name, folder_id))
+    file_ids = batch_get_file_ids(candidates)
+
+    resolved = {}
+    for csv_name, folder_id in datasets:
+        resolved[(csv_name, folder_id)] = None
+        for file_name, file_format in ((dataset_file_name(csv_name), DATASET_FORMAT), (csv_name, 'csv')):
+            file_id = file_ids.get((file_name, folder_id))
+            if file_id:
+                resolved[(csv_name, folder_id)] = (file_name, file_id, file_format)
+                break
+    return resolved
+
+def load_dataset(csv_name, folder_id, stored=None):
+    """Download a labeled dataset. `stored` is an entry from resolve_datasets; looked up if omitted."""
+    if stored is None:
+        stored = resolve_datasets([(csv_name, folder_id)])[(csv_name, folder_id)]
+    if stored is None:
+        return pd.DataFrame()
+    file_name, file_id, file_format = stored
+    return download_dataframe(file_name, folder_id, file_format=file_format, file_id=file_id)
+
+def save_dataset(df, csv_name, folder_id):
+    return upload_dataframe(df, dataset_file_name(csv_name), folder_id, file_format=DATASET_FORMAT)
 
 def get_image_file_id(image_name, image_folder_id):
     if pd.isna(image_name):
         return None
     image_name = str(image_name).strip()
     query = f"name='{image_name}' and '{image_folder_id}' in parents"
-    result = drive_service.files().list(q=query, fields="files(id, name)").execute()
+    with drive_client() as service:
+        result = service.files().list(q=query, fields="files(id, name)").execute()
     items = result.get('files', [])
     return items[0]['id'] if items else None
+
+# --- Batch Helpers ---
+def _is_retriable(error):
+    if not isinstance(error, HttpError):
+        # Transport failure of the whole batch (timeout, dropped connection)
+        return True
+    return error.resp.status in RETRIABLE_STATUSES
+
+def execute_batch(requests, retries=3, delay=2):
+    """
+    Send many Drive calls through the batch endpoint, BATCH_LIMIT per round trip.
+
+    `requests` maps a key to a function that builds the call from a service, e.g.
+    {name: lambda service: service.files().list(q=...)}. Returns (responses, errors),
+    both keyed like `requests`. Items failing with a retriable error (rate limits,
+    5xx) are retried on their own in the next round; the rest are reported at once.
+    """
+    pending = dict(requests)
+    responses, errors = {}, {}
+
+    for attempt in range(retries):
+        if not pending:
+            break
+        if attempt > 0:
+            time.sleep(delay * 2 ** (attempt - 1))
+
+        keys = list(pending)
+        for start in range(0, len(keys), BATCH_LIMIT):
+            chunk = keys[start:start + BATCH_LIMIT]
+
+            def callback(request_id, response, exception, chunk=chunk):
+                key = chunk[int(request_id)]
+                if exception is None:
+                    responses[key] = response
+                    errors.pop(key, None)
+                else:
+                    errors[key] = exception
+
+            try:
+                with drive_client() as service:
+                    batch = service.new_batch_http_request(callback=callback)
+                    for i, key in enumerate(chunk):
+                        batch.add(pending[key](service), request_id=str(i))
+                    batch.execute()
+            except Exception as e:
+                print(f"[Attempt {attempt + 1}] Batch of {len(chunk)} Drive calls failed: {e}")
+                for key in chunk:
+                    if key not in responses:
+                        errors[key] = e
+
+        pending = {key: pending[key] for key in errors if _is_retriable(errors[key])}
+
+    return responses, errors
+
+def batch_get_folder_ids(folder_names, parent_id=None):
+    """Resolve many folder names under `parent_id` at once. Missing folders map to None."""
+    def lookup(name):
+        query = f"mimeType='application/vnd.google-apps.folder' and name='{name}'"
+        if parent_id:
+            query += f" and '{parent_id}' in parents"
+        return lambda service: service.files().list(q=query, spaces='drive', fields='files(id, name)')
+
+    responses, errors = execute_batch({name: lookup(name) for name in folder_names})
+    for name, error in errors.items():
+        print(f"Error resolving folder {name}: {error}")
+
+    folder_ids = {}
+    for name in folder_names:
+        folders = responses.get(name, {}).get('files', [])
+        folder_ids[name] = folders[0]['id'] if folders else None
+    return folder_ids
+
+def batch_create_folders(folder_names, parent_id):
+    def create(name):
+        body = {
+            'name': name,
+            'mimeType': 'application/vnd.google-apps.folder',
+            'parents': [parent_id]
+        }
+        return lambda service: service.files().create(body=body, fields='id')
+
+    responses, errors = execute_batch({name: create(name) for name in folder_names})
+    for name, error in errors.items():
+        print(f"Error creating folder {name}: {error}")
+    return {name: responses[name].get('id') if name in responses else None for name in folder_names}
+
+def batch_resolve_folder_ids(folder_names, parent_id):
+    """Look up many folders under `parent_id`, creating the missing ones. Two round trips at most."""
+    folder_ids = batch_get_folder_ids(folder_names, parent_id)
+    missing = [name for name, folder_id in folder_ids.items() if folder_id is None]
+    if missing:
+        folder_ids.update(batch_create_folders(missing, parent_id))
+    return folder_ids
+
+def batch_get_file_ids(files):
+    """Resolve many (file_name, folder_id) pairs at once. Missing files map to None."""
+    def lookup(name, folder_id):
+        query = f"name='{name}' and '{folder_id}' in parents"
+        return lambda service: service.files().list(q=query, fields="files(id, name)")
+
+    responses, errors = execute_batch({
+        (name, folder_id): lookup(name, folder_id) for name, folder_id in files if folder_id
+    })
+    for key, error in errors.items():
+        print(f"Error resolving file {key[0]}: {error}")
+
+    file_ids = {}
+    for key in files:
+        found = responses.get(key, {}).get('files', [])
+        file_ids[key] = found[0]['id'] if found else None
+    return file_ids
@@ -0,0 +1,215 @@
+# fake_drive.py
+# -----------
+# In-memory stand-in for the Google Drive v3 service, for running drive_utils
+# offline. It understands the queries drive_utils sends, supports the batch
+# endpoint and media downloads, and counts HTTP round trips so batching can be
+# checked:
+#
+#   import drive_utils as du
+#   from fake_drive import FakeDrive
+#
+#   drive = FakeDrive()
+#   root_id = drive.add_folder("LabelingAppData")
+#   du.use_service_factory(drive.service)
+#   du.batch_resolve_folder_ids(["2025_07_24", "2025_08_01"], root_id)
+#   drive.round_trips  # -> 2 (one lookup batch, one create batch)
+
+import re
+import threading
+import httplib2
+from googleapiclient.errors import HttpError
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+
+class FakeDrive:
+    def __init__(self):
+        self.files = {}
+        self.round_trips = 0
+        self._failures = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    # --- Setup helpers ---
+    def add_file(self, name, parent_id=None, mime_type='text/csv', content=b''):
+        with self._lock:
+            self._next_id += 1
+            file_id = f"fake-{self._next_id}"
+            self.files[file_id] = {
+                'id': file_id,
+                'name': name,
+                'mimeType': mime_type,
+                'parents': [parent_id] if parent_id else [],
+                'content': content,
+            }
+        return file_id
+
+    def add_folder(self, name, parent_id=None):
+        return self.add_file(name, parent_id, mime_type=FOLDER_MIME)
+
+    def fail(self, name, *statuses):
+        """Make the next calls touching `name` fail with the given HTTP statuses, in order."""
+        self._failures.setdefault(name, []).extend(statuses)
+
+    def service(self):
+        return _FakeService(self)
+
+    # --- Request handling ---
+    def _check_failure(self, name):
+        with self._lock:
+            statuses = self._failures.get(name)
+            status = statuses.pop(0) if statuses else None
+        if status is not None:
+            resp = httplib2.Response({'status': status})
+            raise HttpError(resp, f'Injected failure for {name}'.encode(), uri='fake://drive')
+
+    def _list(self, q):
+        name = _match(r"(?<!\w)name\s*=\s*'([^']*)'", q)
+        contains = _match(r"name contains '([^']*)'", q)
+        parent = _match(r"'([^']*)' in parents", q)
+        mime = _match(r"mimeType\s*=\s*'([^']*)'", q)
+        self._check_failure(name or contains or parent)
+
+        matches = []
+        for f in list(self.files.values()):
+            if name is not None and f['name'] != name:
+                continue
+            if contains is not None and contains not in f['name']:
+                continue
+            if parent is not None and parent not in f['parents']:
+                continue
+            if mime is not None and f['mimeType'] != mime:
+                continue
+            matches.append({'id': f['id'], 'name': f['name']})
+        return {'files': matches}
+
+    def _create(self, body, media_body=None):
+        self._check_failure(body.get('name'))
+        parents = body.get('parents') or [None]
+        file_id = self.add_file(
+            body['name'],
+            parents[0],
+            mime_type=body.get('mimeType', getattr(media_body, 'mimetype', lambda: None)()),
+            content=_read_media(media_body),
+        )
+        return {'id': file_id}
+
+    def _update(self, fileId, media_body=None):
+        self._check_failure(self.files[fileId]['name'])
+        if media_body is not None:
+            self.files[fileId]['content'] = _read_media(media_body)
+        return {'id': fileId}
+
+
+class _FakeRequest:
+    def __init__(self, drive, run):
+        self._drive = drive
+        self._run = run
+
+    def execute(self, num_retries=0):
+        with self._drive._lock:
+            self._drive.round_trips += 1
+        return self._run()
+
+    def next_chunk(self, num_retries=0):
+        # Resumable uploads arrive whole: a single chunk completes the request
+        return None, self.execute()
+
+
+class _FakeMediaRequest:
+    """A files().get_media() request, downloaded by MediaIoBaseDownload through its `http`."""
+    def __init__(self, drive, file_id):
+        self.uri = f'fake://drive/files/{file_id}?alt=media'
+        self.headers = {}
+        self.http = _FakeMediaHttp(drive, file_id)
+
+
+class _FakeMediaHttp:
+    def __init__(self, drive, file_id):
+        self._drive = drive
+        self._file_id = file_id
+
+    def request(self, uri, method='GET', headers=None, **kwargs):
+        with self._drive._lock:
+            self._drive.round_trips += 1
+        name = self._drive.files.get(self._file_id, {}).get('name')
+        self._drive._check_failure(name)
+        if name is None:
+            return httplib2.Response({'status': 404}), b'File not found'
+
+        # MediaIoBaseDownload asks for one chunk at a time with a Range header
+        content = self._drive.files[self._file_id]['content']
+        start, end = 0, len(content) - 1
+        byte_range = _match(r'bytes=(\d+-\d+)', (headers or {}).get('range', ''))
+        if byte_range:
+            first, last = map(int, byte_range.split('-'))
+            start, end = first, min(last, len(content) - 1)
+        chunk = content[start:end + 1]
+        resp = httplib2.Response({
+            'status': 206,
+            'content-length': str(len(chunk)),
+            'content-range': f'bytes {start}-{start + len(chunk) - 1}/{len(content)}',
+        })
+        return resp, chunk
+
+
+class _FakeFiles:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def list(self, q='', **kwargs):
+        return _FakeRequest(self._drive, lambda: self._drive._list(q))
+
+    def create(self, body=None, media_body=None, **kwargs):
+        return _FakeRequest(self._drive, lambda: self._drive._create(body or {}, media_body))
+
+    def update(self, fileId=None, media_body=None, **kwargs):
+        return _FakeRequest(self._drive, lambda: self._drive._update(fileId, media_body))
+
+    def get_media(self, fileId=None, **kwargs):
+        return _FakeMediaRequest(self._drive, fileId)
+
+
+class _FakeBatch:
+    def __init__(self, drive, callback):
+        self._drive = drive
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self._requests))
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self, http=None):
+        with self._drive._lock:
+            self._drive.round_trips += 1
+        for request_id, request, callback in self._requests:
+            try:
+                response = request._run()
+            except HttpError as e:
+                callback(request_id, None, e)
+            else:
+                callback(request_id, response, None)
+
+
+class _FakeService:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def files(self):
+        return _FakeFiles(self._drive)
+
+    def new_batch_http_request(self, callback=None):
+        return _FakeBatch(self._drive, callback)
+
+
+def _match(pattern, text):
+    found = re.search(pattern, text)
+    return found.group(1) if found else None
+
+
+def _read_media(media_body):
+    if media_body is None:
+        return b''
+    return media_body.getbytes(0, media_body.size())
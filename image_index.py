@@ -0,0 +1,121 @@
+# image_index.py
+# -----------
+# Hash index from image file names to paths, replacing per-listing scans of a
+# folder listing. Scraped images show up under a few name variants:
+#
+#   352886600_6308751702536522_3256442954573697225_n.jpg            (photo_url basename)
+#   89a666f9b74902679c19fbf5339baba2_352886600_..._n.jpg            (<md5>_ prefix, see image_name)
+#   cedar_rapid_ia_500mi_exact_files/352886600_..._n.jpg            (photo_url with folder)
+#
+# Every file is indexed under its full name and each of its variants, and every
+# lookup tries the same variants, so any spelling on either side resolves in
+# O(1). Whole columns are resolved with vectorized string ops and dict lookups.
+
+import os
+import re
+import threading
+import pandas as pd
+
+MD5_PREFIX = r'^[0-9a-f]{32}_'
+# Final part of a Facebook CDN image name, e.g. 352886600_6308751702536522_3256442954573697225_n.jpg
+CANONICAL_NAME = r'(\d+_\d+_?\d*_n\.(?:jpg|jpeg|png|webp|bmp))$'
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+_md5_prefix = re.compile(MD5_PREFIX)
+_canonical_name = re.compile(CANONICAL_NAME)
+
+
+def name_variants(name):
+    """The keys a file name is indexed (and looked up) under, most specific first."""
+    name = os.path.basename(str(name)).strip()
+    variants = [name]
+    stripped = _md5_prefix.sub('', name)
+    if stripped != name:
+        variants.append(stripped)
+    match = _canonical_name.search(name)
+    if match and match.group(1) not in variants:
+        variants.append(match.group(1))
+    return variants
+
+
+class ImageIndex:
+    def __init__(self, paths):
+        """`paths` is an iterable of image paths; the first path seen for a key wins."""
+        self.paths = []
+        self._exact = {}
+        self._variants = {}
+        for path in paths:
+            self.paths.append(path)
+            variants = name_variants(path)
+            self._exact.setdefault(variants[0], path)
+            for key in variants[1:]:
+                self._variants.setdefault(key, path)
+
+    @classmethod
+    def from_folder(cls, folder, recursive=False, extensions=None):
+        def walk():
+            if recursive:
+                for root, _, files in os.walk(folder):
+                    for fname in files:
+                        yield os.path.join(root, fname)
+            else:
+                for fname in os.listdir(folder):
+                    yield os.path.join(folder, fname)
+
+        paths = walk()
+        if extensions is not None:
+            paths = (p for p in paths if os.path.splitext(p)[1].lower() in extensions)
+        return cls(paths)
+
+    def __len__(self):
+        return len(self._exact)
+
+    def resolve(self, photo_url):
+        """Path of the image for a photo_url / image name, or None."""
+        if not isinstance(photo_url, str) or not photo_url:
+            return None
+        variants = name_variants(photo_url)
+        for key in variants:
+            if key in self._exact:
+                return self._exact[key]
+        for key in variants:
+            if key in self._variants:
+                return self._variants[key]
+        return None
+
+    def resolve_column(self, photo_urls):
+        """Vectorized resolve() over a Series; unmatched rows are None."""
+        names = photo_urls.where(photo_urls.map(type) == str).astype("string")
+        names = names.str.rsplit('/', n=1).str[-1].str.strip()
+        stripped = names.str.replace(MD5_PREFIX, '', regex=True)
+        canonical = names.str.extract(CANONICAL_NAME, expand=False)
+
+        paths = pd.Series(pd.NA, index=photo_urls.index, dtype=object)
+        for lookup in (self._exact, self._variants):
+            for keys in (names, stripped, canonical):
+                paths = paths.fillna(keys.map(lookup))
+        return paths.astype(object).where(paths.notna(), None)
+
+    def exists(self, photo_urls):
+        """Vectorized boolean Series: does each photo_url have an image in the index?"""
+        return self.resolve_column(photo_urls).notna()
+
+
+# --- Process-wide cache, invalidated when the folder changes ---
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_index(folder, recursive=False, extensions=None):
+    """Shared ImageIndex for `folder`, rebuilt only when the folder's mtime changes."""
+    key = (os.path.abspath(folder), recursive, frozenset(extensions) if extensions else None)
+    mtime = os.stat(folder).st_mtime_ns
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    index = ImageIndex.from_folder(folder, recursive=recursive, extensions=extensions)
+    with _cache_lock:
+        _cache[key] = (mtime, index)
+    return index
@@ -0,0 +1,92 @@
+# image_source.py
+# -----------
+# Images looked up and read by name from either a folder or a ZIP archive, so
+# the AI tool can use an uploaded archive as is. A ZIP's central directory (the
+# member list stored at the end of the archive) is read once into an
+# ImageIndex and cached while the file is unchanged; members are decompressed
+# only when read. extract() is kept for when files on disk are wanted.
+#
+#   images = get_source("uploaded_data/jdoe/images.zip")
+#   images.exists(df["photo_url"])          # vectorized match check
+#   name = images.resolve(photo_url)        # member name / path, or None
+#   img_bytes = images.read(name)
+
+import os
+import threading
+import zipfile
+import image_index as ii
+
+
+class FolderImages:
+    def __init__(self, folder, extensions=None):
+        self.path = folder
+        self.index = ii.get_index(folder, recursive=True, extensions=extensions)
+
+    def __len__(self):
+        return len(self.index)
+
+    def resolve(self, photo_url):
+        return self.index.resolve(photo_url)
+
+    def exists(self, photo_urls):
+        return self.index.exists(photo_urls)
+
+    def read(self, name):
+        with open(name, "rb") as f:
+            return f.read()
+
+
+class ZipImages:
+    def __init__(self, zip_path, extensions=None):
+        extensions = extensions or ii.IMAGE_EXTENSIONS
+        self.path = zip_path
+        # Raises zipfile.BadZipFile for anything that is not a ZIP archive
+        self._zip = zipfile.ZipFile(zip_path)
+        self.members = [
+            info.filename for info in self._zip.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith("__MACOSX/")
+            and os.path.splitext(info.filename)[1].lower() in extensions
+        ]
+        self.index = ii.ImageIndex(self.members)
+
+    def __len__(self):
+        return len(self.index)
+
+    def resolve(self, photo_url):
+        return self.index.resolve(photo_url)
+
+    def exists(self, photo_urls):
+        return self.index.exists(photo_urls)
+
+    def read(self, name):
+        # ZipFile serializes reads of the underlying file, so threads can share it
+        return self._zip.read(name)
+
+    def extract(self, folder):
+        """Write the image members under `folder`, keeping their paths inside the archive."""
+        self._zip.extractall(folder, members=self.members)
+        return len(self.members)
+
+
+# --- Process-wide cache, invalidated when the archive changes ---
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_source(path, extensions=None):
+    """FolderImages for a folder, or a shared ZipImages for a ZIP rebuilt only when the file changes."""
+    if os.path.isdir(path):
+        return FolderImages(path, extensions=extensions)
+
+    stat = os.stat(path)
+    key = (os.path.abspath(path), frozenset(extensions) if extensions else None)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+    source = ZipImages(path, extensions=extensions)
+    with _cache_lock:
+        _cache[key] = (stamp, source)
+    return source
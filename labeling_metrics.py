@@ -0,0 +1,88 @@
+# labeling_metrics.py
+# -----------
+# Append-only log of labeling timings, one JSON object per line in
+# .cache/labeling_events.jsonl:
+#
+#   {"at": "2025-07-24T12:00:00", "event": "submitted", "user": "jdoe",
+#    "dataset": "2025_07_24/National_Coverage.csv", "ms": 48210.5, "labels": 26}
+#
+# Events written by the labeling page:
+#   page_shown         ms = server time to render a new page, cards = listings on it
+#   first_interaction  ms = from the page being shown to the first label toggle
+#   toggled            ms = server time from a label toggle to its card re-rendered
+#   submitted          ms = from the page being shown to Submit Labels, labels = listings labeled
+#   saved              ms = time to upload the labels to Drive, labels = listings saved
+#
+# throughput() and render_times() aggregate the log for the admin view.
+
+import json
+import os
+import threading
+from datetime import datetime
+import pandas as pd
+
+EVENTS_PATH = os.path.join(os.getcwd(), ".cache", "labeling_events.jsonl")
+
+_lock = threading.Lock()
+
+
+def record(event, user, dataset, **fields):
+    """Append one event to the log. Logging never interrupts labeling."""
+    line = json.dumps({"at": datetime.now().isoformat(), "event": event, "user": user, "dataset": dataset, **fields})
+    try:
+        with _lock:
+            os.makedirs(os.path.dirname(EVENTS_PATH), exist_ok=True)
+            with open(EVENTS_PATH, "a") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        print(f"Could not record labeling event: {e}")
+
+
+def load_events(path=None):
+    path = path or EVENTS_PATH
+    columns = ["at", "event", "user", "dataset", "ms", "labels", "cards"]
+    if os.path.exists(path) and os.path.getsize(path):
+        events = pd.read_json(path, lines=True, dtype=False)
+    else:
+        events = pd.DataFrame(columns=columns)
+    for col in columns:
+        if col not in events.columns:
+            events[col] = pd.NA
+    events["at"] = pd.to_datetime(events["at"])
+    events["ms"] = pd.to_numeric(events["ms"], errors="coerce")
+    events["labels"] = pd.to_numeric(events["labels"], errors="coerce")
+    return events
+
+
+def throughput(events):
+    """
+    Labels per hour of labeling time for each user and dataset, where labeling time
+    is the time from each page being shown to its labels being submitted.
+    """
+    submitted = events[events["event"] == "submitted"]
+    first = events[events["event"] == "first_interaction"]
+    summary = submitted.groupby(["user", "dataset"]).agg(
+        pages=("ms", "size"),
+        labels=("labels", "sum"),
+        hours=("ms", lambda ms: ms.sum() / 3_600_000),
+        median_page_s=("ms", lambda ms: ms.median() / 1000),
+    )
+    summary["labels_per_hour"] = summary["labels"] / summary["hours"].where(summary["hours"] > 0)
+    summary["median_first_interaction_s"] = first.groupby(["user", "dataset"])["ms"].median() / 1000
+    return summary.reset_index().sort_values("labels_per_hour", ascending=False)
+
+
+def render_times(events):
+    """p50/p95 page render time, p95 toggle feedback and p95 save latency per dataset, in milliseconds."""
+    shown = events[events["event"] == "page_shown"].groupby("dataset")["ms"]
+    toggled = events[events["event"] == "toggled"].groupby("dataset")["ms"]
+    saved = events[events["event"] == "saved"].groupby("dataset")["ms"]
+    summary = pd.DataFrame({
+        "pages": shown.size(),
+        "render_p50_ms": shown.quantile(0.5),
+        "render_p95_ms": shown.quantile(0.95),
+        "toggle_p95_ms": toggled.quantile(0.95),
+        "saves": saved.size(),
+        "save_p95_ms": saved.quantile(0.95),
+    })
+    return summary.fillna({"pages": 0, "saves": 0}).reset_index(names="dataset")
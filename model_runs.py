@@ -0,0 +1,309 @@
+# model_runs.py
+# -----------
+# AI model runs as jobs on one process-wide queue, so that users running the
+# model at the same time share the API key pool instead of each pacing
+# themselves as if they had it to themselves.
+#
+# Admission: at most MAX_RUNNING_JOBS jobs run at once, and at most
+# MAX_RUNNING_PER_USER of them for the same user; the others wait in
+# submission order.
+#
+# Rate budget: every API request of every running job goes through
+# Scheduler.acquire(), which starts at most REQUESTS_PER_KEY_PER_MINUTE
+# requests per key per minute across the pool and hands out the keys in
+# rotation. When several jobs are waiting for a request, the next one goes to
+# the job with the smallest virtual finish tag (weighted fair queuing): a job
+# of weight 2 gets twice the requests of a job of weight 1, and a job that was
+# idle does not bank credit while it was away. The AI-Tool page takes each
+# user's weight from USER_WEIGHTS in the secrets.
+#
+# run_model() reports every listing to its Job through the progress callback:
+#
+#   progress("start", total=500)              listings this run will try to evaluate
+#   progress("done", row={...})               a listing was evaluated and appended to the results
+#   progress("skipped", photo_url=..., reason=...)
+#   progress("failed", photo_url=..., reason=...)
+#
+# Job.snapshot() turns those into counts, tokens, throughput and an ETA;
+# forecast() gives queued jobs their position and expected start time.
+
+import itertools
+import threading
+import time
+from collections import deque
+
+# Verdicts kept for the page's "recent verdicts" table
+RECENT_VERDICTS = 20
+# Throughput is measured over the last this many evaluated listings
+THROUGHPUT_WINDOW = 20
+
+# Same budget label_Machine_test paces a single run with (config.DELAY_SECONDS)
+REQUESTS_PER_KEY_PER_MINUTE = 15
+MAX_RUNNING_JOBS = 3
+MAX_RUNNING_PER_USER = 1
+
+_job_ids = itertools.count(1)
+
+
+class Job:
+    def __init__(self, user, input_csv, images_path, result_path, max_to_process, weight=1.0, exclude=(), extensions=None):
+        self._lock = threading.Lock()
+        self.id = next(_job_ids)
+        self.user = user
+        self.input_csv = input_csv
+        self.images_path = images_path
+        self.result_path = result_path
+        self.max_to_process = max_to_process
+        if weight <= 0:
+            raise ValueError(f"A job's weight must be positive, got {weight}")
+        self.weight = weight
+        # Image names found unusable at upload, skipped instead of sent to the API
+        self.exclude = set(exclude)
+        # Image extensions to look for in images_path, the same ones the upload was checked with
+        self.extensions = extensions
+        self.status = "queued"
+        self.error = None
+        self.total = None
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.tokens = 0
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._completed = deque(maxlen=THROUGHPUT_WINDOW)
+        self._recent = deque(maxlen=RECENT_VERDICTS)
+        # Weighted fair queuing tags, maintained by the Scheduler
+        self._finish_tag = 0.0
+        self._start_tag = None
+
+    def __call__(self, event, **info):
+        with self._lock:
+            if event == "start":
+                self.total = info["total"]
+            elif event == "done":
+                row = info["row"]
+                self.done += 1
+                self.tokens += int(row.get("total_tokens") or 0)
+                self._completed.append(time.monotonic())
+                self._recent.appendleft({
+                    "title": row.get("title"),
+                    "price": row.get("price"),
+                    "overall_likelihood": row.get("overall_likelihood"),
+                    "stolen": row.get("stolen"),
+                    "tokens": row.get("total_tokens"),
+                })
+            elif event == "skipped":
+                self.skipped += 1
+            elif event == "failed":
+                self.failed += 1
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+    def remaining(self):
+        """Listings still to evaluate; before the run has counted them, its requested maximum."""
+        with self._lock:
+            total = self.total if self.total is not None else self.max_to_process
+            return max(total - self.done - self.skipped - self.failed, 0)
+
+    def finish(self, error=None):
+        with self._lock:
+            self.status = "failed" if error else "finished"
+            self.error = error
+            self.finished_at = time.time()
+
+    def snapshot(self):
+        """Current state of the run, with throughput (listings/min) and ETA (seconds) once known."""
+        with self._lock:
+            throughput = None
+            if len(self._completed) > 1:
+                elapsed = self._completed[-1] - self._completed[0]
+                if elapsed > 0:
+                    throughput = (len(self._completed) - 1) / elapsed * 60
+            eta = None
+            if throughput and self.total is not None:
+                eta = max(self.total - self.done, 0) / throughput * 60
+            return {
+                "status": self.status,
+                "error": self.error,
+                "total": self.total,
+                "done": self.done,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "tokens": self.tokens,
+                "throughput": throughput,
+                "eta": eta,
+                "elapsed": (self.finished_at or time.time()) - (self.started_at or self.submitted_at),
+                "recent": list(self._recent),
+            }
+
+
+def _admissible(job, running):
+    if len(running) >= MAX_RUNNING_JOBS:
+        return False
+    return sum(other.user == job.user for other in running) < MAX_RUNNING_PER_USER
+
+
+def _pool_size():
+    # config reads the keys from st.secrets and refuses to load without any
+    try:
+        import AI_Model_Files.config as config
+        return max(len(config.API_KEYS), 1)
+    except Exception as e:
+        print(f"Could not read the API key pool: {e}")
+        return 1
+
+
+class Scheduler:
+    def __init__(self, pool_size=None):
+        self._cond = threading.Condition()
+        self._pool_size = pool_size
+        # Every job, in submission order
+        self._jobs = []
+        # Jobs blocked in acquire()
+        self._waiting = set()
+        self._virtual_time = 0.0
+        self._next_request_at = 0.0
+        self._next_key = 0
+
+    @property
+    def pool_size(self):
+        if self._pool_size is None:
+            self._pool_size = _pool_size()
+        return self._pool_size
+
+    @property
+    def requests_per_second(self):
+        return REQUESTS_PER_KEY_PER_MINUTE * self.pool_size / 60
+
+    def jobs(self):
+        with self._cond:
+            return list(self._jobs)
+
+    def submit(self, job):
+        with self._cond:
+            self._jobs.append(job)
+            self._admit()
+        return job
+
+    def _admit(self):
+        # Called with the lock held; the queue is served in submission order, skipping users at their cap
+        running = [job for job in self._jobs if job.status == "running"]
+        for job in self._jobs:
+            if job.status == "queued" and _admissible(job, running):
+                job.status = "running"
+                job.started_at = time.time()
+                running.append(job)
+                threading.Thread(target=self._run, args=(job,), name=f"model-run-{job.id}", daemon=True).start()
+        # Finished jobs are only kept while they are a user's latest
+        latest = {job.user: job for job in self._jobs}
+        self._jobs = [job for job in self._jobs if job.active or latest[job.user] is job]
+
+    def _run(self, job):
+        # Imported here: loading the model clients needs the API keys, only a run does
+        try:
+            from AI_Model_Files.label_Machine_test import run_model
+            run_model(job.input_csv, job.images_path, job.result_path, max_to_process=job.max_to_process,
+                      progress=job, acquire=lambda: self.acquire(job), exclude=job.exclude, extensions=job.extensions)
+        except Exception as e:
+            print(f"Model run for {job.result_path} failed: {e}")
+            job.finish(error=str(e))
+        else:
+            job.finish()
+        with self._cond:
+            self._waiting.discard(job)
+            self._admit()
+            self._cond.notify_all()
+
+    def acquire(self, job):
+        """
+        Block until `job` may send its next API request, and return the index of the
+        key to send it with.
+        """
+        with self._cond:
+            job._start_tag = max(self._virtual_time, job._finish_tag)
+            self._waiting.add(job)
+            self._cond.notify_all()
+            while True:
+                turn = min(self._waiting, key=lambda other: (other._start_tag + 1 / other.weight, other.id))
+                delay = self._next_request_at - time.monotonic()
+                if turn is job and delay <= 0:
+                    break
+                # Woken early when another job starts waiting, in case it is owed the next request
+                self._cond.wait(delay if turn is job else None)
+
+            self._waiting.discard(job)
+            self._virtual_time = job._start_tag
+            job._finish_tag = job._start_tag + 1 / job.weight
+            now = time.monotonic()
+            self._next_request_at = max(now, self._next_request_at) + 1 / self.requests_per_second
+            key_index = self._next_key % self.pool_size
+            self._next_key += 1
+            self._cond.notify_all()
+            return key_index
+
+    def forecast(self):
+        """
+        Queue position (1-based) and expected start time (epoch seconds) of every queued
+        job. Running jobs are assumed to keep their weighted share of the request budget
+        at one request per listing until their remaining listings are done.
+        """
+        with self._cond:
+            jobs = list(self._jobs)
+        running = [job for job in jobs if job.status == "running"]
+        queued = [job for job in jobs if job.status == "queued"]
+        left = {job: job.remaining() for job in running}
+        now = time.time()
+        forecast = {job: {"position": position, "expected_start": None} for position, job in enumerate(queued, start=1)}
+
+        # Fluid simulation: every running job progresses at its share of the budget
+        rate = self.requests_per_second
+        while queued:
+            for job in list(queued):
+                if _admissible(job, list(left)):
+                    forecast[job]["expected_start"] = now
+                    left[job] = job.remaining()
+                    queued.remove(job)
+            if not left:
+                break
+            total_weight = sum(job.weight for job in left)
+            step = min(remaining / (rate * job.weight / total_weight) for job, remaining in left.items())
+            now += step
+            for job in list(left):
+                left[job] -= rate * job.weight / total_weight * step
+                if left[job] <= 1e-9:
+                    del left[job]
+        return forecast
+
+
+# --- Process-wide scheduler, shared by every session ---
+_scheduler = Scheduler()
+
+
+def start(user, input_csv, images_path, result_path, max_to_process, weight=1.0, exclude=(), extensions=None):
+    """
+    Queue a model run for `user`. A run that is already queued or running for the
+    same results file is returned instead of starting a second one.
+    """
+    for job in _scheduler.jobs():
+        if job.active and job.result_path == result_path:
+            return job
+    job = Job(user, input_csv, images_path, result_path, max_to_process, weight=weight, exclude=exclude, extensions=extensions)
+    return _scheduler.submit(job)
+
+
+def get(user):
+    """The user's latest model run, or None."""
+    jobs = [job for job in _scheduler.jobs() if job.user == user]
+    return jobs[-1] if jobs else None
+
+
+def forecast():
+    return _scheduler.forecast()
+
+
+def queue():
+    """Every queued or running job, for showing the shared queue."""
+    return [job for job in _scheduler.jobs() if job.active]
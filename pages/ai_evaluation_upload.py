@@ -1,8 +1,11 @@
 import streamlit as st
 import pandas as pd
-import zipfile
 import os
+import time
+from datetime import datetime
 import shutil
+import upload_manifest as um
+import model_runs
 
 # -- SIDE BAR CONFIGURATION
 
@@ -36,6 +39,85 @@ if logout_clicked:
     for key in list(st.session_state.keys()):
         del st.session_state[key]
 
+# Uploads are copied to disk in pieces of this size instead of as one bytes object
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+def save_upload(uploaded_file, save_path):
+    # Written under a temporary name first so a failed upload never leaves a partial file
+    tmp_path = f"{save_path}.part"
+    uploaded_file.seek(0)
+    with open(tmp_path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f, length=UPLOAD_CHUNK_SIZE)
+    os.replace(tmp_path, save_path)
+
+# Seconds between refreshes of a running model's progress; only the progress block reruns
+PROGRESS_POLL_SECONDS = 2
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+def render_run_progress(progress):
+    total, done = progress["total"], progress["done"]
+    if total:
+        eta = f" · about {format_duration(progress['eta'])} left" if progress["eta"] is not None else ""
+        st.progress(min(done / total, 1.0), text=f"{done:,} of {total:,} listings evaluated{eta}")
+    else:
+        st.progress(0, text="Starting the model...")
+
+    col1, col2, col3, col4, col5 = st.columns(5)
+    col1.metric("Evaluated", f"{done:,}")
+    col2.metric("Skipped (no usable image)", f"{progress['skipped']:,}")
+    col3.metric("Failed", f"{progress['failed']:,}")
+    col4.metric("Tokens", f"{progress['tokens']:,}")
+    col5.metric("Listings / min", f"{progress['throughput']:.1f}" if progress["throughput"] else "–")
+
+    if progress["recent"]:
+        st.markdown("**Recent verdicts**")
+        st.dataframe(pd.DataFrame(progress["recent"]), hide_index=True, use_container_width=True)
+
+def render_queue(run):
+    # Runs of every user share the API keys; queued runs start as running ones finish
+    forecast = model_runs.forecast()
+    if run in forecast:
+        expected = forecast[run]["expected_start"]
+        when = f"expected to start in about {format_duration(max(expected - time.time(), 0))}" if expected else "waiting for a free slot"
+        st.info(f"⏳ Your run is number {forecast[run]['position']} in the queue, {when}.")
+
+    rows = []
+    for job in model_runs.queue():
+        position = forecast[job]["position"] if job in forecast else None
+        expected = forecast[job]["expected_start"] if job in forecast else None
+        rows.append({
+            "Run": "Yours" if job is run else "Another user",
+            "Status": job.status.capitalize(),
+            "Position": position,
+            "Listings left": job.remaining(),
+            "Expected start": datetime.fromtimestamp(expected).strftime("%H:%M") if expected else None,
+        })
+    if rows:
+        st.markdown("**Model queue**")
+        st.dataframe(pd.DataFrame(rows).astype({"Position": "Int64"}), hide_index=True, use_container_width=True)
+
+@st.fragment(run_every=PROGRESS_POLL_SECONDS)
+def poll_run_progress(run):
+    progress = run.snapshot()
+    if progress["status"] not in ("queued", "running"):
+        # One full rerun picks up the finished results file and stops the polling
+        st.session_state.model_success = progress["status"] == "finished"
+        st.rerun()
+    if progress["status"] == "running":
+        render_run_progress(progress)
+    render_queue(run)
+
+@st.fragment(run_every=PROGRESS_POLL_SECONDS)
+def poll_integrity(base_path, manifest):
+    # The image check runs in the background; one full rerun shows its results
+    if not um.get_integrity(base_path, manifest)["pending"]:
+        st.rerun()
+    st.info(f"🔍 Checking {manifest['images']['count']} images... The model can be run once the check is done.")
+
 # --- Check user session ---
 
 import glob
@@ -54,27 +136,19 @@ os.makedirs(base_path, exist_ok=True)
 existing_csvs = glob.glob(os.path.join(base_path, "*.csv"))
 existing_zips = glob.glob(os.path.join(base_path, "*.zip"))
 
-# Detect existing CSV and ZIP
-# Exclude any CSVs that are model result files
-csv_files = [
-    f for f in os.listdir(base_path)
-    if f.endswith(".csv") and "model_results" not in f
-]
-zip_files = [f for f in os.listdir(base_path) if f.endswith(".zip")]
-result_file = [
-    f for f in os.listdir(base_path)
-    if f.endswith(".csv") and "model_results" in f
-]
+# Detect existing CSV, ZIP and model results (CSVs named *model_results* are results)
+# The manifest only re-reads a file when its mtime or size changed since the last rerun
+manifest = um.get_manifest(base_path)
 
 # -- CHECK IF FILES EXIST
-csv_exists = len(csv_files) > 0
-zip_exists = len(zip_files) > 0
-result_exists = len(result_file) > 0
+csv_exists = manifest["csv"] is not None
+zip_exists = manifest["zip"] is not None
+result_exists = manifest["result"] is not None
 
 # -- FIND FILE PATHS
-csv_path = os.path.join(base_path, csv_files[0]) if csv_exists else None
-zip_path = os.path.join(base_path, zip_files[0]) if zip_exists else None
-result_path = os.path.join(base_path, result_file[0]) if result_exists else None
+csv_path = manifest["csv"]["path"] if csv_exists else None
+zip_path = manifest["zip"]["path"] if zip_exists else None
+result_path = manifest["result"]["path"] if result_exists else None
 
 # -- FIND FILE NAMES         
 csv_filename = os.path.basename(csv_path) if csv_exists else None
@@ -82,15 +156,12 @@ zip_filename = os.path.basename(zip_path) if zip_exists else None
 result_filename = os.path.basename(result_path) if result_exists else None
 
 if csv_exists:
-    # Step 1: Load the original CSV
-    df_original = pd.read_csv(csv_path)
-    total_original = len(df_original)
+    # Step 1: Rows in the original CSV
+    total_original = manifest["csv"]["rows"]
 
-df_result = None
 if result_exists:
-    # Load the results file if exist and compare results
-    df_result = pd.read_csv(result_path)
-    labeled_count = len(df_result)
+    # Compare the results file with the original CSV
+    labeled_count = manifest["result"]["rows"]
     remaining = total_original - labeled_count
 
 # -- ACTUAL PAGE CONTENT STARTS
@@ -174,8 +245,7 @@ with col2:
                 
                 # Save new CSV
                 save_path = os.path.join(base_path, new_csv.name)
-                with open(save_path, "wb") as f:
-                    f.write(new_csv.read())
+                save_upload(new_csv, save_path)
 
                 name_csv = new_csv.name
 
@@ -193,25 +263,25 @@ with col2:
                 st.session_state.new_csv_file = False
                 st.rerun()
 
-            # --- Validate CSV if uploaded ---
+            # --- Validate CSV if uploaded (checked once per version of the file) ---
+            csv_valid = False
             if csv_exists:
-                try:
-                    # VALIDATE NAME: NO NAMES CONTAINING MODEL_RESULTS
-
-                    df = pd.read_csv(csv_path)
-                    required_cols = {"photo_url", "price", "title", "location", "origin_city_list"}
-                    missing_cols = required_cols - set(df.columns)
-                    if missing_cols:
-                        st.error(f"🚫 Missing columns in CSV: {', '.join(missing_cols)}")
-                        df = None
-                    else:
-                        st.success(f"✅ CSV `{csv_files[0]}` validated successfully.")
-                except Exception as e:
-                    st.error(f"🚫 Error reading CSV: {e}")
-                    df = None
+                if manifest["csv"]["error"]:
+                    st.error(f"🚫 Error reading CSV: {manifest['csv']['error']}")
                     st.stop()
-            else:
-                df = None
+                missing_cols = manifest["csv"]["missing_columns"]
+                if missing_cols:
+                    st.error(f"🚫 Missing columns in CSV: {', '.join(missing_cols)}")
+                else:
+                    st.success(f"✅ CSV `{csv_filename}` validated successfully.")
+                    csv_valid = True
+
+                    # Row problems do not block the model; it skips listings without an image
+                    issue_count = manifest["csv"]["issue_count"]
+                    if issue_count:
+                        st.warning(f"⚠️ Found {issue_count:,} problem(s) in the rows of `{csv_filename}`.")
+                        with st.expander("🔎 Rows with problems"):
+                            st.dataframe(manifest["csv"]["issues"], hide_index=True, use_container_width=True)
         
         with st.container(border=True):
 
@@ -235,8 +305,7 @@ with col2:
 
                 # Save new ZIP
                 save_path = os.path.join(base_path, new_zip.name)
-                with open(save_path, "wb") as f:
-                    f.write(new_zip.read())
+                save_upload(new_zip, save_path)
 
                 #  Reset any flags and rerun
                 st.session_state.model_success = False
@@ -250,41 +319,51 @@ with col2:
                 st.rerun()
 
             # Define extracted image folder
-            images_folder = os.path.join(base_path, "extracted_images")
-            images_extracted = os.path.exists(images_folder) and len(os.listdir(images_folder)) > 0
-
-            # --- Step 4: Extract ZIP if not already extracted ---
-            if zip_exists and not images_extracted:
-                try:
-                    os.makedirs(images_folder, exist_ok=True)
-                    with st.spinner("🔧 Extracting images..."):
-                        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                            zip_ref.extractall(images_folder)
-                            number_images = len(zip_ref.namelist()) - 1 # minus 1 is because the unzipped file is a nested folder, folder extracted_images > original zipped folder name > images as .png or .jpg 
-                        st.success(f"✅ Extracted {number_images} images")
-                        images_extracted = True
-                        # st.rerun()
-                except zipfile.BadZipFile:
+            images_folder = os.path.join(base_path, um.EXTRACTED_FOLDER)
+
+            # --- Step 4: Read images straight from the ZIP (or from a previous extraction) ---
+            images = None
+            if manifest["images"] is not None:
+                if manifest["images"]["error"]:
                     st.error("🚫 Uploaded ZIP file is invalid.")
                     st.stop()
+                images = manifest["images"]["source"]
 
-            # --- Step 6: Compare image filenames with CSV ---
-            if df is not None and images_extracted:
-                valid_exts = [".jpg", ".jpeg", ".png", ".webp"]
-                extracted_images = {
-                    fname.strip()
-                    for root, _, files in os.walk(images_folder)
-                    for fname in files
-                    if os.path.splitext(fname)[1].lower() in valid_exts
-                }
-
-                df["image_filename"] = df["photo_url"].apply(
-                    lambda x: os.path.basename(x).strip() if isinstance(x, str) and x else ""
-                )
-                df["image_exists"] = df["image_filename"].isin(extracted_images)
-
-                matched = df["image_exists"].sum()
-                total = len(df)
+                if images.path == zip_path:
+                    st.success(f"✅ Found {manifest['images']['count']} images in `{zip_filename}`")
+
+                    # Not needed by the model, which reads the images from the ZIP
+                    if st.button("📂 Extract images to disk", help="Only needed to browse the images as files."):
+                        with st.spinner("🔧 Extracting images..."):
+                            number_images = images.extract(images_folder)
+                        st.success(f"✅ Extracted {number_images} images")
+                        st.rerun()
+
+            # --- Step 5: Check every image before the model sees it (cached until the images change) ---
+            unusable_images = set()
+            checking_images = False
+            if images is not None:
+                integrity = um.get_integrity(base_path, manifest)
+                checking_images = integrity["pending"]
+            if checking_images:
+                poll_integrity(base_path, manifest)
+            elif images is not None:
+                if integrity["error"]:
+                    st.warning(f"⚠️ Could not check the images: {integrity['error']}")
+                unusable = integrity["unusable"]
+                unusable_images = set(unusable["name"])
+                if len(unusable):
+                    st.warning(f"⚠️ {len(unusable)} image(s) are empty, corrupt or truncated and will be skipped by the model.")
+                    with st.expander("🔎 Unusable images"):
+                        st.dataframe(unusable[["name", "bytes", "problem"]], hide_index=True, use_container_width=True)
+                if len(integrity["mismatched"]):
+                    st.info(f"ℹ️ {len(integrity['mismatched'])} image(s) have an extension that does not match their format. They are sent to the model as their real format.")
+
+            # --- Step 6: Compare image filenames with CSV (cached until either file changes) ---
+            match = manifest["match"] if csv_valid else None
+            if match is not None:
+                matched = match["matched"]
+                total = match["total"]
                 missing = total - matched
 
                 st.info(f"📸 {matched}/{total} listings have matching images.")
@@ -293,24 +372,17 @@ with col2:
 
                 if missing > 0:
                     with st.expander("⚠️ Listings missing images"):
-                        st.dataframe(df[~df["image_exists"]][["photo_url", "image_filename"]])
+                        st.dataframe(match["missing"])
 
     st.divider()
 
     # --- ACTUAL AI MODEL SECTION
 
-    from AI_Model_Files.label_Machine_test import run_model
-    import AI_Model_Files.config as config
-    from datetime import datetime
-
     # --- Final Check: Ready to run AI ---
-    if csv_exists and images_extracted and "image_exists" in df.columns:
-
-        # Keep only listings with images that exists
-        df_to_evaluate = df[df["image_exists"] == True]
+    if csv_exists and images is not None and match is not None:
 
         # Number of total listings that have images to be evaluated
-        total_rows = len(df_to_evaluate)
+        total_rows = matched
 
         st.markdown("## 🤖 Ready to Run AI Model")
         st.success("All inputs are validated. You can now run the AI model to evaluate the listings.")
@@ -350,7 +422,11 @@ with col2:
             value=min(500, total_rows),  # default value, like 500 or full if small
             step=50)
 
-            if st.button("🚀 Run AI Model on Listings"):
+            # The model runs in the background on a queue shared by all users; its progress is polled below without rerunning the page
+            run = model_runs.get(username)
+            active = run is not None and run.active
+
+            if st.button("🚀 Run AI Model on Listings", disabled=active or checking_images):
 
                 # Only create a result path in case one already does not exist
                 print(f"Result file exists?? {result_exists}")
@@ -361,18 +437,20 @@ with col2:
                     result_filename = f"{original_name}_model_results_{timestamp}.csv"
                     result_path = os.path.join(base_path, result_filename)
 
-                with st.spinner("Running model... this may take a few minutes ⏳"):
-                    try:
-                        # Run your model
-                        run_model(csv_path, images_folder, result_path, max_to_process=max_to_process)
-
-                        st.session_state.model_success = True
-
-                        st.rerun()
+                # Users listed under USER_WEIGHTS in the secrets get that share of the key pool (default 1)
+                weight = float(st.secrets.get("USER_WEIGHTS", {}).get(username, 1.0))
+                model_runs.start(username, csv_path, images.path, result_path, max_to_process,
+                                 weight=weight, exclude=unusable_images, extensions=um.IMAGE_EXTENSIONS)
+                st.session_state.model_success = False
+                st.rerun()
 
-                    except Exception as e:
-                        st.error(f"🚫 Error running model: {e}")
-                        st.session_state.model_success = False
+            if active:
+                poll_run_progress(run)
+            elif run is not None:
+                progress = run.snapshot()
+                if progress["status"] == "failed":
+                    st.error(f"🚫 Error running model: {progress['error']}")
+                render_run_progress(progress)
             
             if "model_success" in st.session_state:
                 if st.session_state.model_success == True:
@@ -1,6 +1,7 @@
 import streamlit as st
-import numpy as np
 import pandas as pd
+import csv_validation as cv
+import results_analytics as ra
 
 # -- SIDE BAR CONFIGURATION
 
@@ -36,26 +37,6 @@ if logout_clicked:
 
 # -- START OF PAGE HERE
 
-# Map common truthy/falsy values to 1/0
-def to_binary(val):
-    # 1) Treat NaN or infinite as missing
-    if pd.isna(val) or (isinstance(val, (int, float)) and not np.isfinite(val)):
-        # if value is Nan return 0
-        if pd.isna(val):
-            return 0 # np.nan
-        else:
-            # Normalize to lowercase string
-            v = str(val).strip().lower()
-
-            # Map truthy/falsy
-            if v in ("1", "true", "yes", "y", "t"):
-                return 1
-            elif v in ("0", "false", "no", "n", "f"):
-                return 0
-
-    # 4) Anything else is junk/missing
-    return np.nan
-
 # If Logout is clicked
 if st.session_state.get("logout", False):
     for key in list(st.session_state.keys()):
@@ -108,28 +89,22 @@ with col2:
     uploaded_file = st.file_uploader("📁 Upload your labeled CSV file", type=["csv"])
 
     if uploaded_file is not None:
-        df = pd.read_csv(uploaded_file)
-
-        # --- Check required columns ---
-        required_cols = {
-            "price", "title", "location", "origin_city_list", "overall_likelihood"
-        }
-
-        ai_label_cols = {
-            "model_name", "reasoning", "price_suspicion", "item_bulk",
-            "item_new", "listing_tone", "mentions_retailer", "overall_likelihood", "stolen"
-        }
-
-        missing_cols = required_cols.union(ai_label_cols) - set(df.columns)
-
-        for col in missing_cols:
-            if "created_missing_cols" not in st.session_state:
-                st.session_state.created_missing_cols = True
-            else:
-                if col == "overall_likelihood":
-                    df[col] = np.random.randint(1, 11, size=len(df))  # Random int from 1 to 10
-                else:
-                    df[col] = np.nan
+        # Streamed checks first, so an unreadable file is reported without parsing all of it (once per file content)
+        report = ra.validation_report(uploaded_file)
+        if report["error"]:
+            st.error(f"🚫 {report['error']}")
+            st.stop()
+        if report["issue_count"]:
+            st.warning(f"⚠️ Found {report['issue_count']:,} problem(s) in the rows of the file.")
+            with st.expander("🔎 Rows with problems"):
+                st.dataframe(cv.issues_frame(report), hide_index=True, use_container_width=True)
+
+        # Parsed and normalized once per file content; reruns only redo the threshold-dependent parts
+        results = ra.load(uploaded_file)
+        df = results.frame
+
+        # --- Check required columns (missing ones were added with default values) ---
+        missing_cols = results.missing_columns
 
         if missing_cols:
             st.warning(f"⚠️ The following columns were missing and have been added with default values: {', '.join(missing_cols)}")
@@ -137,7 +112,7 @@ with col2:
             st.success("✅ File uploaded and all required columns are present.")
 
         # --- Optional Column Check: binary_flag ---
-        has_manual_label = "binary_flag" in df.columns
+        has_manual_label = results.has_manual_label
         if has_manual_label:
             st.info("✅ Manual labels (`binary_flag`) detected. You can compare them with AI predictions.")
         else:
@@ -156,13 +131,8 @@ with col2:
         st.markdown("Choose the minimum likelihood score (1–10) that you consider to indicate a 'Likely Stolen' item.")
         threshold = st.slider("Likelihood Threshold", min_value=1, max_value=10, value=5)
 
-        # --- Create binary column from AI score ---
-
-        # Convert to numeric first (non-numeric values become NaN)
-        df["overall_likelihood"] = pd.to_numeric(df["overall_likelihood"], errors="coerce")
-
-        # Then apply the threshold
-        df["ai_binary"] = df["overall_likelihood"].apply(lambda x: 1 if x >= threshold else 0)
+        # --- Flag listings from the AI score (missing scores are never flagged) ---
+        ai_binary = results.flagged(threshold)
 
         # Page Layout
         col1, col2 = st.columns([0.6,2])
@@ -171,7 +141,7 @@ with col2:
         with col1:
             st.subheader("📊 Dataset Summary")
             total = len(df)
-            flagged = df["ai_binary"].sum()
+            flagged = int(ai_binary.sum())
             percentage = round((flagged / total) * 100, 2)
             with st.container(border=True):
                 st.metric("Total Listings", total)
@@ -183,10 +153,10 @@ with col2:
             tab1, tab2 = st.tabs(["📈 Distribution of AI Likelihood Scores", "📦 Box Plot: Price vs. AI Label"])
             with tab1:
                 st.markdown("##### Distribution of AI Likelihood Scores")
-                score_counts = df["overall_likelihood"].value_counts().sort_index().reset_index()
+                score_counts = results.score_counts.reset_index()
                 score_counts.columns = ["Score", "Count"]
                 fig_scores = px.line(score_counts, x="Score", y="Count", markers=True)
-                st.plotly_chart(fig_scores, title="📈 Distribution of AI Likelihood Scores", use_container_width=True)
+                st.plotly_chart(fig_scores, use_container_width=True)
 
             with tab2:
                 import plotly.graph_objects as go
@@ -196,14 +166,14 @@ with col2:
                 fig = go.Figure()
 
                 fig.add_trace(go.Box(
-                    y=df[df['ai_binary'] == 0]['price'],
+                    y=df.loc[~ai_binary, 'price'],
                     name='Not Likely Stolen',
                     marker_color='blue',
                     boxpoints=False  # Hide individual points
                 ))
 
                 fig.add_trace(go.Box(
-                    y=df[df['ai_binary'] == 1]['price'],
+                    y=df.loc[ai_binary, 'price'],
                     name='Likely Stolen',
                     marker_color='red',
                     boxpoints=False  # Hide individual points
@@ -223,39 +193,17 @@ with col2:
 
         col1, col2 = st.columns([2,2])
 
-        # -- US REGIONS GRAPH
-
-        # -- Region Mapping Setup --
-        us_regions = {
-            "Northeast": ["CT", "ME", "MA", "NH", "RI", "VT", "NJ", "NY", "PA"],
-            "Midwest":   ["IL", "IN", "MI", "OH", "WI", "IA", "KS", "MN", "MO", "NE", "ND", "SD"],
-            "South":     ["DE", "FL", "GA", "MD", "NC", "SC", "VA", "DC", "WV", "AL", "KY", "MS", "TN", "AR", "LA", "OK", "TX"],
-            "West":      ["AZ", "CO", "ID", "MT", "NV", "NM", "UT", "WY", "AK", "CA", "HI", "OR", "WA"]
-        }
-
-        def get_region(state_abbr):
-            for region, states in us_regions.items():
-                if state_abbr in states:
-                    return region
-            return "Other"
+        # -- US REGIONS GRAPH (state and region of every listing come from results_analytics) --
 
             # -- Pie and Bar for Flagged Items by Location --
 
         st.subheader("🗺️ Location Breakdown for Flagged Items")
 
-        # -- Extract State Abbreviation from "location" column --
-        df["state_abbr"] = df["location"].str.extract(r",\s*([A-Z]{2})", expand=False)
-
-        # -- Filter flagged listings only --
-        flagged_df = df[df["ai_binary"] == 1].copy()
-
-        if flagged_df.empty:
+        if not ai_binary.any():
             st.warning("No flagged listings found for geographic analysis.")
         else:
-            flagged_df["region"] = flagged_df["state_abbr"].apply(get_region)
-
             # ---- Pie Chart by Region ----
-            region_counts = flagged_df["region"].value_counts().reset_index()
+            region_counts = results.flagged_counts("region", threshold).reset_index()
             region_counts.columns = ["Region", "Count"]
 
             pie_fig = px.pie(region_counts, values="Count", names="Region",
@@ -263,7 +211,7 @@ with col2:
                             color_discrete_sequence=px.colors.qualitative.Set2)
 
             # ---- Bar Chart by State ----
-            state_counts = flagged_df["state_abbr"].value_counts().reset_index()
+            state_counts = results.flagged_counts("state_abbr", threshold).reset_index()
             state_counts.columns = ["State", "Count"]
 
             bar_fig = px.bar(state_counts.sort_values("Count", ascending=False),
@@ -280,7 +228,7 @@ with col2:
 
             # ---- Bar Chart by City ----
             st.subheader("🗺️ Flagged Listings by US Cities")
-            state_counts = flagged_df["location"].value_counts().reset_index()
+            state_counts = results.flagged_counts("location", threshold).reset_index()
             state_counts.columns = ["City", "Count"]
 
             top_n = st.slider("Choose the number of cities to display", min_value=5, max_value=50, value=20, step=5)
@@ -302,25 +250,27 @@ with col2:
 
             st.markdown("<hr style='margin:1px 0;' />", unsafe_allow_html=True)
 
-            # Prepare comparison flags
-            df["manual_binary"] = df["binary_flag"].apply(to_binary)
+            # Comparison flags (manual_binary is prepared with the cached frame)
+            manual_binary = df["manual_binary"].to_numpy()
 
-            # Drop dataframe index
-            df = df.reset_index(drop=True)
+            # Subsets of the labeled listings (NaN matches neither 1 nor 0), so the tables agree with the sweep's counts
+            both      = df[ai_binary & (manual_binary == 1)]
+            ai_only   = df[ai_binary & (manual_binary == 0)]
+            manual_only = df[~ai_binary & (manual_binary == 1)]
 
-            # Subsets
-            both      = df[(df["ai_binary"] == 1) & (df["manual_binary"] == 1)]
-            ai_only   = df[(df["ai_binary"] == 1) & (df["manual_binary"] == 0)]
-            manual_only = df[(df["ai_binary"] == 0) & (df["manual_binary"] == 1)]
+            # Confusion counts at the selected threshold: true positives are flagged by both, etc.
+            sweep = results.sweep
+            current = sweep.loc[threshold]
+            n_both, n_ai_only, n_manual_only = int(current["tp"]), int(current["fp"]), int(current["fn"])
 
             col1, middle, col2, col3 = st.columns([1.2, 0.3,2,2])
 
             with col1:
                 st.markdown("######")
                 st.markdown("##### 📝 Labeling Summary")
-                total = len(both)
-                ai_tool = len(ai_only)
-                manual = len(manual_only)
+                total = n_both
+                ai_tool = n_ai_only
+                manual = n_manual_only
                 with st.container(border=True):
                     st.metric("🤝 Flagged by Both Methods", total)
                     st.metric("🤖 Flagged by AI-Tool Only", ai_tool)
@@ -330,7 +280,7 @@ with col2:
                 # Proportions OF AI FLAGGED
                 comp_counts = pd.DataFrame({
                     "Category": ["Both", "AI Only"],
-                    "Count":    [len(both), len(ai_only)]
+                    "Count":    [n_both, n_ai_only]
                 })
                 comp_counts["Pct"] = comp_counts["Count"] / len(df) * 100
 
@@ -348,7 +298,7 @@ with col2:
                 # Proportions OF MANUALLY FLAGGED
                 comp_counts = pd.DataFrame({
                     "Category": ["Both",  "Manual Only"],
-                    "Count":    [len(both), len(manual_only)]
+                    "Count":    [n_both, n_manual_only]
                 })
                 comp_counts["Pct"] = comp_counts["Count"] / len(df) * 100
 
@@ -366,6 +316,57 @@ with col2:
                     })
                 st.plotly_chart(fig_comp, use_container_width=True)
 
+            # --- Threshold sweep: precision, recall and F1 of every threshold against the manual labels ---
+            st.subheader("🎯 Threshold Sweep")
+
+            def pct(value):
+                return "–" if pd.isna(value) else f"{value:.0%}"
+
+            def ratio(value):
+                return "–" if pd.isna(value) else f"{value:.2f}"
+
+            best = results.best_threshold
+            if best is not None:
+                st.info(
+                    f"💡 Recommended threshold: **{best}** — F1 {ratio(sweep.loc[best, 'f1'])}, "
+                    f"precision {pct(sweep.loc[best, 'precision'])}, recall {pct(sweep.loc[best, 'recall'])}. "
+                    f"At your threshold of {threshold}: F1 {ratio(current['f1'])}, "
+                    f"precision {pct(current['precision'])}, recall {pct(current['recall'])}."
+                )
+
+            col1, col2, col3 = st.columns(3)
+
+            with col1:
+                metrics = sweep[["precision", "recall", "f1"]].reset_index().melt(id_vars="threshold", var_name="Metric", value_name="Value")
+                fig_sweep = px.line(metrics, x="threshold", y="Value", color="Metric", markers=True,
+                                    title="📈 Precision, Recall and F1 by Threshold")
+                fig_sweep.add_vline(x=threshold, line_dash="dash", line_color="gray")
+                fig_sweep.update_layout(xaxis_title="Likelihood Threshold", yaxis_range=[0, 1])
+                st.plotly_chart(fig_sweep, use_container_width=True)
+
+            with col2:
+                roc = results.roc_curve()
+                auc = ra.area_under(roc["fpr"], roc["tpr"])
+                fig_roc = px.line(roc, x="fpr", y="tpr", markers=True, hover_data=["threshold"],
+                                  title=f"📉 ROC Curve (AUC {auc:.2f})")
+                fig_roc.add_scatter(x=[current["fpr"]], y=[current["recall"]], mode="markers",
+                                    marker=dict(size=12, color="red"), name=f"Threshold {threshold}")
+                fig_roc.update_layout(xaxis_title="False Positive Rate", yaxis_title="True Positive Rate (Recall)")
+                st.plotly_chart(fig_roc, use_container_width=True)
+
+            with col3:
+                pr = results.pr_curve()
+                fig_pr = px.line(pr, x="recall", y="precision", markers=True, hover_data=["threshold"],
+                                 title="🎯 Precision–Recall Curve")
+                fig_pr.add_scatter(x=[current["recall"]], y=[current["precision"]], mode="markers",
+                                   marker=dict(size=12, color="red"), name=f"Threshold {threshold}")
+                fig_pr.update_layout(xaxis_title="Recall", yaxis_title="Precision", yaxis_range=[0, 1])
+                st.plotly_chart(fig_pr, use_container_width=True)
+
+            with st.expander("🧮 Confusion counts for every threshold"):
+                st.dataframe(sweep.style.format({col: "{:.2f}" for col in ["precision", "recall", "f1", "fpr"]}),
+                             use_container_width=True)
+
             # Columns to show
             show_cols = [
                 "listing_url", "price", "title", "location", "origin_city_list",
@@ -1,10 +1,10 @@
 import streamlit as st
-import pandas as pd
 import sys
-import os
 import re
 from datetime import datetime
-import drive_utils as du
+import dataset_catalog as dc
+import dataset_store as ds
+import labeling_metrics as lm
 
 # -- SIDE BAR CONFIGURATION
 
@@ -43,8 +43,117 @@ if logout_clicked:
 if "user_name" not in st.session_state:
     st.switch_page("pages/login.py")
 
-# GitHub folder config (dataset folders pushed with the app)
-DATASETS_DIR = os.path.join(os.getcwd(), "Data")
+def selected_dataset_for(entry):
+    return {
+        "csv_path": entry["csv_path"],
+        "images_folder": entry["images_folder"],
+        "folder_name": entry["folder_name"],
+        "location": entry["location"],
+        "range": entry["range"],
+        "drive_file": entry["file"],
+        "drive_folder_id": entry["drive_folder_id"],
+        "catalog_key": entry["key"]
+    }
+
+def is_admin(username):
+    try:
+        return username in st.secrets.get("ADMIN_USERS", [])
+    except Exception:
+        return False
+
+def render_throughput():
+    events = lm.load_events()
+    if events.empty:
+        st.info("No labeling activity recorded yet.")
+        return
+    st.markdown("**Labels per hour** (labeling time runs from a page being shown to its submit)")
+    st.dataframe(lm.throughput(events), hide_index=True, use_container_width=True)
+    st.markdown("**Page render and save times**")
+    st.dataframe(lm.render_times(events), hide_index=True, use_container_width=True)
+
+def open_labeling_page(selected_dataset):
+    # Labeling state belongs to a single dataset, start it fresh
+    for key in ("label_overlay", "label_queue", "page_rows", "labels_submitted", "batch_labels"):
+        st.session_state.pop(key, None)
+    st.session_state.selected_dataset = selected_dataset
+    st.switch_page("pages/labeling_page.py")
+
+def render_dataset_row(entry):
+    folder_name = entry["folder_name"]
+    file = entry["file"]
+    date = entry["date"]
+
+    total = entry["total"]
+    labeled = entry["labeled"]
+    file_in_drive = entry["stored_file_id"] is not None
+
+    if total == 0:
+        return
+    else:
+        col1, col2, col3, col4, col5, col6, col7 = st.columns([1.2, 0.8, 1, 1, 0.8, 1.9,1.8])
+        with col1: st.write(f"**{entry['location']}**")
+        with col2: st.write(entry["range"])
+        with col3: st.write(f"**{date}**")
+        with col4:
+            st.markdown(f"""
+                <div style="
+                    display: flex;
+                    margin-left: 5px;
+                    align-items: center;
+                    height: 100%;  /* Optional: define height if vertical centering isn't working */
+                ">
+                    {labeled if file_in_drive else 0}
+                </div>
+            """, unsafe_allow_html=True)
+        with col5: st.write(total)
+        with col6:
+            key = f"select_{folder_name}_{file}"
+            if not file_in_drive or labeled == 0:
+                if st.button("🚀 Start Labeling", key=key):
+                    try:
+                        selected_dataset = selected_dataset_for(entry)
+                        # First save creates the labeled copy on Drive and shares the frame
+                        ds.save_labels(selected_dataset, {})
+                        open_labeling_page(selected_dataset)
+                        st.session_state.file_missing = False
+
+                    except Exception as e:
+                        if (
+                            hasattr(e, "resp") 
+                            and hasattr(e, "content") 
+                            and "storageQuotaExceeded" in str(e.content)
+                        ):
+                            st.session_state.file_missing = True
+                            st.warning(
+                                f"⚠️ File **{file}** missing from Google Drive: Please add this CSV to the folder **{folder_name}**."
+                            )
+                    else:
+                        st.error("An unexpected error occurred during upload.")
+                        st.exception(e)
+
+            elif labeled == total and total > 0:
+                st.button("✅ Complete", key=key, disabled=True)
+            else:
+                if st.button("🔘 Continue Labeling", key=key):
+                    open_labeling_page(selected_dataset_for(entry))
+        with col7:
+            if "file_missing" not in st.session_state:
+                disabled = False
+            else:
+                if st.session_state.file_missing == True:
+                    disabled = True
+                else:
+                    disabled = False
+            # The CSV is only built when the button is clicked, then cached until the next save
+            compressed = total > ds.LARGE_EXPORT_ROWS
+            st.download_button(
+                label="⬇️ Download CSV (.gz)" if compressed else "⬇️ Download CSV",
+                disabled=disabled,
+                data=lambda entry=entry, compressed=compressed: ds.export_csv(selected_dataset_for(entry), compressed=compressed),
+                file_name=f"{file}.gz" if compressed else file,
+                mime="application/gzip" if compressed else "text/csv",
+                key=f"download_{date}_{file}"
+            )
 
 st.set_page_config(page_title="Datasets for Label", layout="wide")
 
@@ -80,207 +189,26 @@ with content_col:
     for col, label in zip(header_cols, headers):
         col.markdown(f"<div style='margin-bottom: 0.8rem'><strong>{label}</strong></div>", unsafe_allow_html=True)
 
-    if os.path.exists(DATASETS_DIR):
-        for folder_name in sorted(os.listdir(DATASETS_DIR), reverse=True):
-            if not folder_name.startswith("20"):
-                continue
-
-            folder_path = os.path.join(DATASETS_DIR, folder_name)
-            if not os.path.isdir(folder_path):
-                continue
-
-            for file in os.listdir(folder_path):
-                # Skip dataset if its images folder doesn't exist
-                images_folder = os.path.join(folder_path, file.replace(".csv", "_files"))
-                print(images_folder)
-
-                if not os.path.exists(images_folder):
-                    continue
-                if not file.endswith(".csv"):
-                    continue
-
-                csv_path = os.path.join(folder_path, file)
-                images_folder = os.path.join(folder_path, file.replace(".csv", "_files"))
-
-                # New logic to support merged/national datasets
-                location_parts = file.replace(".csv", "").split("_")
-
-                if len(location_parts) >= 3 and location_parts[-1].endswith("mi"):
-                    # Standard city_state_miles format
-                    location = " ".join(location_parts[:-1]).title()
-                    range_miles = location_parts[-1]
-                else:
-                    # Fallback for merged or national datasets
-                    location = " ".join(location_parts).title()
-                    range_miles = "Merged"
-
-                drive_folder_id = du.get_folder_id_by_name(folder_name, parent_id=st.session_state.root_folder_id)
-                
-                if not drive_folder_id:
-                    drive_folder_id = du.create_drive_folder(folder_name, st.session_state.root_folder_id)
-
-                labeled_file_id = du.get_file_id_by_name(file, drive_folder_id)
-                date = folder_name.replace("_", "/")
-                local_key = f"local_df_{date}_{file}"
-
-                # If there is a df in the Drive download this csv and check again for any updates in the images in the folder
-                if labeled_file_id:
-                    labeled_df = du.download_csv(file, drive_folder_id)
-                    df = labeled_df.copy() if not labeled_df.empty else None
-
-                    if df is not None:
-                        # Ensure required columns exist
-                        if 'user_name' not in df.columns:
-                            df['user_name'] = pd.Series([pd.NA] * len(df), dtype="string")
-                        if 'binary_flag' not in df.columns:
-                            df['binary_flag'] = pd.Series([pd.NA] * len(df), dtype="string")
-                        if 'timestamp' not in df.columns:
-                            df['timestamp'] = pd.Series([pd.NA] * len(df), dtype="string")
-                        if 'image_exist' not in df.columns:
-                            df['image_exist'] = pd.Series([False] * len(df))
-                        
-                        # Create a set of all image filenames in the folder
-                        image_files = set(os.listdir(images_folder))
-
-                        def match_image_exists(photo_url):
-                            if not isinstance(photo_url, str) or pd.isna(photo_url):
-                                return False
-
-                            photo_name = os.path.basename(photo_url).strip()
-
-                            # DEBUG: Check sample match attempts
-                            for img in image_files:
-                                if img.endswith(photo_name):
-                                    return True
-                            return False
-
-                        df['image_exist'] = df['photo_url'].apply(match_image_exists)
-                        print(f"Number of images that are matched: {len(df[df['image_exist'] == True])}")
-
-                        length = len(df[df['image_exist'] == True])
-                else:
-                    df = None
-
-                # If there is no df in the Drive creates a copy of the local df with the new columns
-                if df is None:
-                    df_original = pd.read_csv(csv_path)
-                    df = df_original.copy()
-
-                    df['user_name'] = pd.Series([pd.NA] * len(df), dtype="string")
-                    df['binary_flag'] = pd.Series([pd.NA] * len(df), dtype="string")
-                    df['timestamp'] = pd.Series([pd.NA] * len(df), dtype="string")
-
-                    # Create a set of all image filenames in the folder
-                    image_files = set(os.listdir(images_folder))
-
-                    def match_image_exists(photo_url):
-                        if not isinstance(photo_url, str) or pd.isna(photo_url):
-                            return False
-
-                        photo_name = os.path.basename(photo_url).strip()
-
-                        # DEBUG: Check sample match attempts
-                        for img in image_files:
-                            if img.endswith(photo_name):
-                                return True
-                        return False
-
-                    df['image_exist'] = df['photo_url'].apply(match_image_exists)
-                    print(f"Number of images that are matched: {len(df[df['image_exist'] == True])}")
-
-                st.session_state[local_key] = df
-
-                total = len(df[df['image_exist'] == True])
-                labeled = df[(df['binary_flag'].notna()) & (df['image_exist'] == True)].shape[0] if 'binary_flag' in df.columns else 0
-                file_in_drive = labeled_file_id is not None
-
-                if total == 0:
-                    continue
-                else:
-                    col1, col2, col3, col4, col5, col6, col7 = st.columns([1.2, 0.8, 1, 1, 0.8, 1.9,1.8])
-                    with col1: st.write(f"**{location}**")
-                    with col2: st.write(range_miles)
-                    with col3: st.write(f"**{date}**")
-                    with col4:
-                        st.markdown(f"""
-                            <div style="
-                                display: flex;
-                                margin-left: 5px;
-                                align-items: center;
-                                height: 100%;  /* Optional: define height if vertical centering isn't working */
-                            ">
-                                {labeled if file_in_drive else 0}
-                            </div>
-                        """, unsafe_allow_html=True)
-                    with col5: st.write(total)
-                    with col6:
-                        key = f"select_{folder_name}_{file}"
-                        if not file_in_drive or labeled == 0:
-                            if st.button("🚀 Start Labeling", key=key):
-                                try:
-                                    du.upload_csv(df, file, drive_folder_id)
-                                    st.session_state.selected_dataset = {
-                                        "csv_path": csv_path,
-                                        "images_folder": images_folder,
-                                        "folder_name": folder_name,
-                                        "location": location,
-                                        "range": range_miles,
-                                        "drive_file": file,
-                                        "drive_folder_id": drive_folder_id
-                                    }
-                                    st.session_state.current_df = df
-                                    st.switch_page("pages/labeling_page.py")
-                                    st.session_state.file_missing = False
-
-                                except Exception as e:
-                                    if (
-                                        hasattr(e, "resp") 
-                                        and hasattr(e, "content") 
-                                        and "storageQuotaExceeded" in str(e.content)
-                                    ):
-                                        st.session_state.file_missing = True
-                                        st.warning(
-                                            f"⚠️ File **{file}** missing from Google Drive: Please add this CSV to the folder **{folder_name}**."
-                                        )
-                                else:
-                                    st.error("An unexpected error occurred during upload.")
-                                    st.exception(e)
-
-                        elif labeled == total and total > 0:
-                            st.button("✅ Complete", key=key, disabled=True)
-                        else:
-                            if st.button("🔘 Continue Labeling", key=key):
-                                st.session_state.selected_dataset = {
-                                    "csv_path": csv_path,
-                                    "images_folder": images_folder,
-                                    "folder_name": folder_name,
-                                    "location": location,
-                                    "range": range_miles,
-                                    "drive_file": file,
-                                    "drive_folder_id": drive_folder_id
-                                }
-                                st.session_state.current_df = df
-                                st.switch_page("pages/labeling_page.py")
-                    with col7:
-                        if "file_missing" not in st.session_state:
-                            disabled = False
-                        else:
-                            if st.session_state.file_missing == True:
-                                disabled = True
-                            else:
-                                disabled = False
-                        csv_bytes = df.to_csv(index=False).encode("utf-8")
-                        st.download_button(
-                            label="⬇️ Download CSV",
-                            disabled=disabled,
-                            data=csv_bytes,
-                            file_name=file,
-                            mime="text/csv",
-                            key=f"download_{date}_{file}"
-                        )            
-        st.divider()
-        if st.button("🔒 Logout"):
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
-            st.rerun()
+    # The catalog only rebuilds datasets that changed on disk; the button forces a full rescan
+    refresh_clicked = st.button("🔄 Refresh Datasets", key="refresh_catalog")
+
+    # Reserve a row per dataset in display order, then fill each one as soon as its
+    # entry is ready, so the page waits on the slowest dataset instead of all of them
+    datasets = dc.scan_data_folder()
+    rows = {key: st.container() for key in datasets}
+    with st.spinner("Loading datasets..."):
+        for entry in dc.iter_refresh(st.session_state.root_folder_id, force=refresh_clicked, local=datasets):
+            with rows[entry["key"]]:
+                render_dataset_row(entry)
+
+    # Labeling speed across users, for the usernames listed under ADMIN_USERS in the secrets
+    if is_admin(st.session_state.get("user_username")):
+        with st.expander("📈 Labeling Throughput"):
+            render_throughput()
+
+    st.divider()
+    if st.button("🔒 Logout"):
+        for key in list(st.session_state.keys()):
+            del st.session_state[key]
+        st.rerun()
 
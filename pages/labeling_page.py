@@ -1,15 +1,19 @@
 import streamlit as st
 import pandas as pd
 import sys
-import os
-import re
+import time
 from datetime import datetime
-import drive_utils as du
-import base64
+import dataset_store as ds
+import thumbnails as th
+import priority_index as pi
+import labeling_metrics as lm
 import math
 # import streamlit_extras
 # from streamlit_extras.let_it_rain import rain
 
+# Server time of this run, logged when it shows a new page of listings
+render_started = time.perf_counter()
+
 # -- SIDE BAR CONFIGURATION
 
 hide_streamlit_nav_spacing = """
@@ -33,6 +37,13 @@ st.sidebar.page_link("pages/welcome.py", label="Home Page")
 st.sidebar.page_link("pages/database_label.py", label="Data for Label")
 st.sidebar.page_link("pages/data_visualization.py", label="Data Visualization")
 st.sidebar.page_link("pages/ai_evaluation_upload.py", label="AI-Tool")
+st.sidebar.markdown("## Queue")
+st.sidebar.radio(
+    "Serve listings in",
+    ["Dataset order", "Most uncertain first"],
+    key="queue_order",
+    help="Most uncertain first serves listings whose AI score (from the AI-Tool results) is closest to the stolen threshold. Applies from the next page."
+)
 # Capture the button click
 logout_clicked = st.sidebar.button("Logout", use_container_width=True)
 
@@ -53,6 +64,16 @@ if "selected_dataset" not in st.session_state:
 
 sel = st.session_state.selected_dataset
 
+def save_overlay(overlay):
+    # Timed, so slow Drive uploads show up in the labeling log
+    started = time.perf_counter()
+    ds.save_labels(sel, overlay)
+    lm.record(
+        "saved", st.session_state.user_username, ds.dataset_key(sel),
+        ms=(time.perf_counter() - started) * 1000, labels=len(overlay)
+    )
+    overlay.clear()
+
 # MAIN TITLE
 
 col1, col2, col3 = st.columns([4, 1, 0.7])  # side space, center title, side button
@@ -67,35 +88,30 @@ with col3:
             with st.spinner("Saving Progress...", show_time=True):
                 # labels_submmited initiated and equalts True
                 if "labels_submitted" in st.session_state and st.session_state.labels_submitted == True:
-                    if "recent_labeled_df" in st.session_state:
-                        df_tosave = st.session_state.recent_labeled_df
-                        du.upload_csv(df_tosave, sel['drive_file'], sel['drive_folder_id'])
+                    if st.session_state.get("label_overlay"):
+                        save_overlay(st.session_state.label_overlay)
                         st.success("Progress saved to Google Drive!")
                         st.session_state.progress_saved = True
         except Exception as e:
             st.error(f"Failed to upload: {e}")
 
-if "current_df" not in st.session_state:
-    st.session_state.current_df = du.download_csv(sel['drive_file'], sel['drive_folder_id'])
+# Shared view of the dataset (one per revision for all users) plus this user's unsaved labels
+view = ds.get_view(sel)
 
-df = st.session_state.current_df
+if "label_overlay" not in st.session_state:
+    st.session_state.label_overlay = {}
+overlay = st.session_state.label_overlay
 
-total = len(df[df['image_exist'] == True])
-labeled = df[(df['binary_flag'].notna()) & (df['image_exist'] == True)].shape[0] if 'binary_flag' in df.columns else 0
+# This user's place in the unlabeled queue; rebuilt (keeping its order) only when the dataset gets a new revision
+if st.session_state.get("label_queue") is None or st.session_state.label_queue.revision != view.revision:
+    st.session_state.label_queue = ds.LabelQueue(view, overlay, previous=st.session_state.get("label_queue"))
+queue = st.session_state.label_queue
 
-if "recent_labeled_df" not in st.session_state:
-    display_labeled = labeled
-else:
-    recent_df = st.session_state.recent_labeled_df
-    display_labeled = recent_df[(recent_df['binary_flag'].notna()) & (recent_df['image_exist'] == True)].shape[0] if 'binary_flag' in recent_df.columns else 0
+total, labeled = queue.total, queue.labeled
 
 # PROGRESS BAR
 
-st.progress(display_labeled / total if total else 0, text=f"{display_labeled} out of {total} listings labeled")
-
-df_with_image = df[df['image_exist'] == True].reset_index(drop=True)
-
-not_labeled = df_with_image[df_with_image['binary_flag'].isna()].reset_index(drop=True)
+st.progress(labeled / total if total else 0, text=f"{labeled} out of {total} listings labeled")
 
 # HEADER DATASET INFO
 
@@ -135,36 +151,46 @@ if "labels_submitted" in st.session_state and st.session_state.labels_submitted
     with col4: 
         if st.button("➡️ Next"):
             st.session_state.labels_submitted = False
-            st.session_state.current_df = st.session_state.recent_labeled_df
-            # st.session_state.recent_labeled_df = ""
+            del st.session_state.page_rows
             st.rerun()
 
 st.markdown("<hr style='margin:1px 0;' />", unsafe_allow_html=True)
 
 # Total pages based on df_with_image (entire set of listings with images)
 items_per_page = 25
-total_pages = math.ceil(total / items_per_page)  # ceiling division
-
-# Finding the current page number
-page_calculation = math.ceil(labeled / items_per_page) + 1
-
-if page_calculation > total_pages:
-     st.session_state.page_number = total_pages
-else:
-    st.session_state.page_number = page_calculation
+# Pages after the current one whose thumbnails are warmed in the background
+prefetch_pages = 2
+# Duplicates are labeled together, so pages count groups of listings rather than listings
+total_pages = math.ceil(queue.total_groups / items_per_page)  # ceiling division
 
 # PAGINATION
 
-start_idx = 0
-if total_pages > page_calculation:
-    end_idx = start_idx + 25
-else:
-    end_idx = start_idx + (total - labeled)
-
-print("Start and End Indexes for upcoming page: ", start_idx, end_idx)
+# The rows on the page stay fixed until "Next" is clicked, even after their labels are submitted
+if "page_rows" not in st.session_state:
+    # Re-sort what is left of the queue when the order changes or new AI scores came in
+    if st.session_state.get("queue_order") == "Most uncertain first":
+        scores = pi.get_index()
+        if queue.order != ("uncertainty", scores.version):
+            remaining = queue.remaining()
+            priority = scores.uncertainty(view.frame.loc[remaining, 'listing_url'])
+            queue.reorder(priority, order=("uncertainty", scores.version))
+    elif queue.order is not None:
+        queue.reorder()
+
+    st.session_state.page_rows = queue.next_page(items_per_page)
+    # Set once the page has been rendered, see the end of the page
+    st.session_state.page_shown_at = None
+    st.session_state.page_interacted = False
+
+    # Finding the current page number
+    page_calculation = math.ceil(queue.labeled_groups / items_per_page) + 1
+
+    if page_calculation > total_pages:
+        st.session_state.page_number = total_pages
+    else:
+        st.session_state.page_number = page_calculation
 
-page_df = not_labeled.iloc[start_idx:end_idx].copy()
-# st.write(page_df)
+page_df = view.page(st.session_state.page_rows)
 
 current_page = st.session_state.page_number 
 
@@ -180,7 +206,7 @@ st.markdown(
 )
 
 if labeled == total:
-    # du.upload_csv(df.copy(), sel['drive_file'], sel['drive_folder_id'])
+    # du.save_dataset(df.copy(), sel['drive_file'], sel['drive_folder_id'])
     # rain(emoji="🎉", font_size = 54, falling_speed = 5, animation_length = 10)
     st.success("🎉 All listings have been labeled and uploaded to the drive successfully!")
 
@@ -193,6 +219,88 @@ rows = [page_df[i:i+num_cols] for i in range(0, len(page_df), num_cols)]
 if "batch_labels" not in st.session_state:
     st.session_state.batch_labels = {}
 
+def toggle_label(uid):
+    st.session_state.batch_labels[uid] = not st.session_state.batch_labels[uid]
+    st.session_state.toggle_started = time.perf_counter()
+    if not st.session_state.get("page_interacted") and st.session_state.get("page_shown_at"):
+        st.session_state.page_interacted = True
+        lm.record(
+            "first_interaction", st.session_state.user_username, ds.dataset_key(st.session_state.selected_dataset),
+            ms=(time.time() - st.session_state.page_shown_at) * 1000
+        )
+
+# A toggle reruns only its own card: the rest of the page (dataset, counts, pagination) is left as is
+@st.fragment
+def render_card(listing, uid, image_path):
+    # Determine current state
+    is_selected = st.session_state.batch_labels[uid]
+
+    # Define appearance
+    label = "✅ Likely Stolen" if is_selected else "⬜ Likely Stolen"
+    button_type = "primary" if is_selected else "secondary"
+
+    # Create the border status for each listing co
+    if is_selected == True:
+        border_style = "8px solid red"
+    else:
+        border_style = "4px solid white"
+
+    if image_path is not None:
+
+        # Resized once and cached; a static URL when static serving is on
+        image_src = th.thumbnail_src(image_path)
+
+        # Build the HTML string for the container
+        if str(listing['price']) == "Free":
+            price = str(listing['price'])
+            html = f"""
+        <div style="display: flex; flex-direction: column; justify-content: space-between; height: 100%;">
+            <img src="{image_src}" style="width: 100%; border-radius: 10px; margin-bottom: 6px; border: {border_style};" />
+            <div style="font-weight: bold; font-size: 16px; margin-bottom: 5px;">
+                {price}
+            </div>
+            <div style="font-size: 14px; margin-bottom: 3px;">
+                {listing["title"]}
+            </div>
+            <div style="font-size: 13px; color: #666; margin-bottom: 10px;">
+                {listing["location"]}
+            </div>
+        """
+        else: 
+            price = float(str(listing['price']).replace("$", "").replace(",", "").strip())    
+            html = f"""
+        <div style="display: flex; flex-direction: column; justify-content: space-between; height: 100%;">
+            <img src="{image_src}" style="width: 100%; border-radius: 10px; margin-bottom: 10px; border: {border_style};" />
+            <div style="font-weight: bold; font-size: 16px; margin-bottom: 5px;">
+                ${price:,.2f}
+            </div>
+            <div style="font-size: 14px; margin-bottom: 3px;">
+                {listing["title"]}
+            </div>
+            <div style="font-size: 13px; color: #666; margin-bottom: 10px;">
+                {listing["location"]}
+            </div>
+        """
+        # Reposts of this listing share its label
+        if listing['duplicates'] > 0:
+            html += f"""
+            <div style="font-size: 12px; color: #666; margin-bottom: 6px;">
+                🔁 +{listing['duplicates']} duplicate listing{'s' if listing['duplicates'] > 1 else ''}
+            </div>
+        """
+        st.markdown(html, unsafe_allow_html=True)                 
+
+    # Capturing the state of the selected item
+    st.button(label, key=f"btn_{uid}", type=button_type, on_click=toggle_label, args=(uid,))
+
+    # Toggle-to-feedback time on the server: from the click callback to this card re-rendered
+    toggle_started = st.session_state.pop("toggle_started", None)
+    if toggle_started is not None:
+        lm.record(
+            "toggled", st.session_state.user_username, ds.dataset_key(st.session_state.selected_dataset),
+            ms=(time.perf_counter() - toggle_started) * 1000
+        )
+
 # Creating each listing using the rows in the df
 
 for row_df in rows:
@@ -202,19 +310,8 @@ for row_df in rows:
             listing = row_df.iloc[idx]
             uid = f"{listing['listing_url']}__{listing['photo_url']}"
 
-            import re
-
-            # Extract only the final part of the image name
-            full_name = os.path.basename(listing['photo_url'])
-            match = re.search(r'(\d+_\d+_?\d*)_n\.(jpg|jpeg|png|webp|bmp)$', full_name)
-
-            if match:
-                image_name = f"{match.group(1)}_n.{match.group(2)}"
-            else:
-                image_name = full_name  # fallback in case regex fails
-
-
-            image_path = os.path.join(sel['images_folder'], image_name)
+            # Resolved once per dataset revision through the images folder's hash index
+            image_path = listing['image_path']
 
             # Checkbox outside the HTML so Streamlit can capture its state
             # if f"batch_labels[{uid}]" not in st.session_state:
@@ -222,67 +319,13 @@ for row_df in rows:
                 # if st.session_state.batch_labels[uid]
                 st.session_state.batch_labels[uid] = False
 
-            # Determine current state
-            is_selected = st.session_state.batch_labels[uid]
-
-            # Define appearance
-            label = "✅ Likely Stolen" if is_selected else "⬜ Likely Stolen"
-            button_type = "primary" if is_selected else "secondary"
-
-            # Create the border status for each listing co
-            if st.session_state.batch_labels[uid] == True:
-                border_style = "8px solid red"
-            else:
-                border_style = "4px solid white"
-
-            # st.markdown(f"{uid}")
-            
-            # Capturing the state of the selected item
-
             with col.container(height=440, border=False):
-                if os.path.exists(image_path):
-
-                    # Read image file in binary mode
-                    with open(image_path, "rb") as image_file:
-                        encoded_image = base64.b64encode(image_file.read()).decode()
-
-                    # Build the HTML string for the container
-                    if str(listing['price']) == "Free":
-                        price = str(listing['price'])
-                        html = f"""
-                    <div style="display: flex; flex-direction: column; justify-content: space-between; height: 100%;">
-                        <img src="data:image/jpeg;base64,{encoded_image}" style="width: 100%; border-radius: 10px; margin-bottom: 6px; border: {border_style};" />
-                        <div style="font-weight: bold; font-size: 16px; margin-bottom: 5px;">
-                            {price}
-                        </div>
-                        <div style="font-size: 14px; margin-bottom: 3px;">
-                            {listing["title"]}
-                        </div>
-                        <div style="font-size: 13px; color: #666; margin-bottom: 10px;">
-                            {listing["location"]}
-                        </div>
-                    """
-                    else: 
-                        price = float(str(listing['price']).replace("$", "").replace(",", "").strip())    
-                        html = f"""
-                    <div style="display: flex; flex-direction: column; justify-content: space-between; height: 100%;">
-                        <img src="data:image/jpeg;base64,{encoded_image}" style="width: 100%; border-radius: 10px; margin-bottom: 10px; border: {border_style};" />
-                        <div style="font-weight: bold; font-size: 16px; margin-bottom: 5px;">
-                            ${price:,.2f}
-                        </div>
-                        <div style="font-size: 14px; margin-bottom: 3px;">
-                            {listing["title"]}
-                        </div>
-                        <div style="font-size: 13px; color: #666; margin-bottom: 10px;">
-                            {listing["location"]}
-                        </div>
-                    """
-                    st.markdown(html, unsafe_allow_html=True)                 
-
-                # Capturing the state of the selected item
-                if st.button(label, key=f"btn_{uid}", type=button_type):
-                    st.session_state.batch_labels[uid] = not is_selected
-                    st.rerun()
+                render_card(listing, uid, image_path)
+
+# With this page drawn, prepare the next ones so "Next Page" renders without reading any image
+current_rows = set(st.session_state.page_rows)
+upcoming = [row for row in queue.next_page(items_per_page * (prefetch_pages + 1)) if row not in current_rows]
+th.prefetch(view.image_paths.loc[upcoming])
 
 if "labels_submitted" not in st.session_state:
     st.session_state.labels_submitted = False
@@ -291,24 +334,30 @@ col1, col2, col3, col4, col5, col6, col7 = st.columns([2,2,2,2.3,2, 2,2])
 with col4:
     if st.session_state.labels_submitted == False:
         if st.button("✅ Submit Labels", type="secondary"):
-            listing = 0
-            # Copying original dataframe 
-            copy_df  = df.copy(deep=True)
-            for row in page_df.itertuples():
-                uid = f"{row.listing_url}__{row.photo_url}"
-                is_stolen = st.session_state.batch_labels.get(uid)
-
-                index = copy_df[(copy_df['listing_url'] == row.listing_url) & (copy_df['photo_url'] == row.photo_url)].index
-                if not index.empty:
-                    listing += 1
-                    copy_df.at[index[0], 'binary_flag'] = "Yes" if is_stolen else "No"
-                    copy_df.at[index[0], 'user_name'] = str(st.session_state.user_username)
-                    copy_df.at[index[0], 'timestamp'] = datetime.now().isoformat()
+            # Labels go into this user's overlay, keyed by (listing_url, photo_url); the shared frame is only touched on save
+            user_name = str(st.session_state.user_username)
+            timestamp = datetime.now().isoformat()
+            flags = {
+                row: "Yes" if st.session_state.batch_labels.get(f"{listing_url}__{photo_url}") else "No"
+                for row, listing_url, photo_url in zip(page_df.index, page_df['listing_url'], page_df['photo_url'])
+            }
+            # Each listing's label also goes to its unlabeled duplicates
+            pairs = view.members(page_df.index)
+            members = view.frame.loc[[member for _, member in pairs], ['listing_url', 'photo_url']]
+            overlay.update(
+                (key, (flags[row], user_name, timestamp))
+                for key, (row, _) in zip(zip(members['listing_url'], members['photo_url']), pairs)
+            )
+            queue.submitted(list(flags), [member for _, member in pairs])
+            if st.session_state.get("page_shown_at"):
+                lm.record(
+                    "submitted", user_name, ds.dataset_key(sel),
+                    ms=(time.time() - st.session_state.page_shown_at) * 1000, labels=len(pairs), cards=len(flags)
+                )
 
             #rain(emoji="🎉", font_size = 54, falling_speed = 5, animation_length = 10)        
             st.session_state.labels_submitted = True
             st.session_state.progress_saved = False
-            st.session_state.recent_labeled_df = copy_df
             st.session_state.batch_labels = {}
             st.rerun()
     else:
@@ -342,19 +391,17 @@ with col7:
     if st.session_state.labels_submitted == True:
         if st.button("➡️ Next Page", type="secondary"):
             st.session_state.labels_submitted = False
-            st.session_state.current_df = st.session_state.recent_labeled_df
-            # st.session_state.recent_labeled_df = ""
+            del st.session_state.page_rows
             st.rerun()
 
 st.markdown("<hr style='margin:1px 0;' />", unsafe_allow_html=True)
 
-if labeled < total:
+if labeled < total or overlay:
     if st.button("💾 Save Progress", key="save_progress_bottom"):
         try:
             with st.spinner("Saving Progress...", show_time=True):
-                if "recent_labeled_df" in st.session_state:
-                    df_tosave = st.session_state.recent_labeled_df
-                    du.upload_csv(df_tosave, sel['drive_file'], sel['drive_folder_id'])
+                if overlay:
+                    save_overlay(overlay)
             st.success("Progress saved to Google Drive!")
 
             st.session_state.progress_saved = True
@@ -367,15 +414,14 @@ if labeled < total:
 if st.button("⬅️ Back to Datasets"):
     # print("Status of progress saved: ", st.session_state.progress_saved)
     # if st.session_state.progress_saved == False:
-    if "recent_labeled_df" not in st.session_state:
+    if not overlay:
         st.switch_page("pages/database_label.py")
     else:
         if "progress_saved" not in st.session_state or st.session_state.progress_saved == False:
             try:
                 with st.spinner("Saving Progress...", show_time=True):
-                    if "recent_labeled_df" in st.session_state:
-                        df_tosave = st.session_state.recent_labeled_df
-                        du.upload_csv(df_tosave, sel['drive_file'], sel['drive_folder_id'])
+                    if overlay:
+                        save_overlay(overlay)
                 st.success("Progress saved to Google Drive!")
                 st.session_state.label_submitted = False
                 st.session_state.progress_saved = True
@@ -392,9 +438,8 @@ with st.popover("🔒 Logout",):
         print("Button save and logout clicked")
         try:
             with st.spinner("Saving Progress...", show_time=True):
-                if "recent_labeled_df" in st.session_state:
-                    df_tosave = st.session_state.recent_labeled_df
-                    du.upload_csv(df_tosave, sel['drive_file'], sel['drive_folder_id'])
+                if overlay:
+                    save_overlay(overlay)
             st.success("Progress saved to Google Drive!")
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
@@ -406,4 +451,12 @@ with st.popover("🔒 Logout",):
         st.write("You will be logged out")
         for key in list(st.session_state.keys()):
             del st.session_state[key]
-        st.rerun()
\ No newline at end of file
+        st.rerun()
+
+# The first complete run of a page is when the labeler sees it
+if st.session_state.get("page_shown_at") is None and "page_rows" in st.session_state:
+    st.session_state.page_shown_at = time.time()
+    lm.record(
+        "page_shown", st.session_state.user_username, ds.dataset_key(sel),
+        ms=(time.perf_counter() - render_started) * 1000, cards=len(st.session_state.page_rows)
+    )
@@ -23,7 +23,7 @@ USERS_CSV = 'users.csv'
 
 def reset_local_dataframes():
     for key in list(st.session_state.keys()):
-        if key.startswith("local_df_") or key == "current_df":
+        if key in ("label_overlay", "label_queue", "page_rows"):
             del st.session_state[key]
 
 st.title("🔐 Login")
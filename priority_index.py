@@ -0,0 +1,104 @@
+# priority_index.py
+# -----------
+# AI scores for ordering the labeling queue, read from the AI tool's
+# *_model_results_*.csv files under uploaded_data/. A listing whose
+# overall_likelihood (1-10) sits next to the model's decision threshold
+# (stolen = score >= STOLEN_THRESHOLD) is the one a human label tells the most
+# about, so "most uncertain first" serves those listings before the others.
+#
+# Result files only grow (run_model appends a row per listing), so a refresh
+# reads just the bytes appended since the previous one; a file that shrank is
+# read again from the start. Scores are keyed by listing_url, latest row wins.
+
+import glob
+import io
+import os
+import threading
+import pandas as pd
+
+RESULTS_DIR = os.path.join(os.getcwd(), "uploaded_data")
+RESULTS_PATTERN = "*model_results*.csv"
+
+# Same cut as label_Machine_test: overall_likelihood >= 7 means stolen
+STOLEN_THRESHOLD = 7
+
+
+class PriorityIndex:
+    def __init__(self):
+        # path -> (bytes consumed, column names)
+        self._files = {}
+        self._scores = {}
+        self._lock = threading.Lock()
+        # Bumped whenever a refresh adds scores, so queues know when to re-sort
+        self.version = 0
+
+    def __len__(self):
+        return len(self._scores)
+
+    def _read_new_rows(self, path):
+        size = os.stat(path).st_size
+        offset, columns = self._files.get(path, (0, None))
+        if size < offset:
+            offset, columns = 0, None
+        if size == offset:
+            return False
+
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read(size - offset)
+        # Leave a row that is still being written for the next refresh
+        end = data.rfind(b"\n") + 1
+        if end == 0:
+            return False
+        try:
+            if columns is None:
+                rows = pd.read_csv(io.BytesIO(data[:end]))
+                columns = list(rows.columns)
+            else:
+                rows = pd.read_csv(io.BytesIO(data[:end]), header=None, names=columns)
+        except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError) as e:
+            print(f"Could not read new results from {path}: {e}")
+            return False
+        self._files[path] = (offset + end, columns)
+
+        if "listing_url" not in rows.columns or "overall_likelihood" not in rows.columns:
+            return False
+        scores = pd.to_numeric(rows["overall_likelihood"], errors="coerce")
+        found = scores.notna() & rows["listing_url"].notna()
+        self._scores.update(zip(rows.loc[found, "listing_url"], scores[found]))
+        return bool(found.any())
+
+    def refresh(self, paths):
+        """Read the rows appended to `paths` since the last refresh."""
+        changed = False
+        with self._lock:
+            for path in paths:
+                try:
+                    changed |= self._read_new_rows(path)
+                except OSError as e:
+                    print(f"Could not read results file {path}: {e}")
+            if changed:
+                self.version += 1
+
+    def uncertainty(self, listing_urls):
+        """
+        Distance of each listing's score from the decision threshold, as a Series with
+        the index of `listing_urls`; listings the model has not scored are NaN.
+        """
+        with self._lock:
+            scores = listing_urls.map(self._scores).astype(float)
+        return (scores - (STOLEN_THRESHOLD - 0.5)).abs()
+
+
+# --- Process-wide index, shared by every session ---
+_index = PriorityIndex()
+
+
+def result_files(results_dir=RESULTS_DIR):
+    return sorted(glob.glob(os.path.join(results_dir, "**", RESULTS_PATTERN), recursive=True))
+
+
+def get_index():
+    """The shared PriorityIndex, brought up to date with the result files on disk."""
+    _index.refresh(result_files(RESULTS_DIR))
+    return _index
@@ -0,0 +1,212 @@
+# results_analytics.py
+# -----------
+# Data behind the Data Visualization page. An uploaded CSV is parsed and
+# normalized once per content (keyed by its SHA-1), and everything that does
+# not depend on the likelihood threshold is computed then, with vectorized
+# operations:
+#
+#   overall_likelihood  numeric score, NaN when missing or not a number
+#   manual_binary       binary_flag mapped to 1/0, NaN when missing or neither
+#   state_abbr, region  from "City, ST" locations, as categoricals
+#
+# Flagged counts per region, state and city are kept per score value, so a
+# threshold change only sums the rows of the scores at or above it. With
+# manual labels, threshold_sweep() bins the labeled listings' scores once and derives
+# the confusion counts, precision/recall/F1 and ROC/PR points of every
+# threshold from cumulative sums, so the page only looks up its row.
+#
+#   report = validation_report(uploaded_file)     # csv_validation report, also cached
+#   results = load(uploaded_file)
+#   flagged = results.flagged(threshold)          # boolean mask over results.frame
+#   results.flagged_counts("region", threshold)   # Series, largest first
+#   results.sweep.loc[threshold, "f1"], results.best_threshold
+
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import csv_validation as cv
+
+REQUIRED_COLUMNS = {"price", "title", "location", "origin_city_list", "overall_likelihood"}
+AI_LABEL_COLUMNS = {
+    "model_name", "reasoning", "price_suspicion", "item_bulk",
+    "item_new", "listing_tone", "mentions_retailer", "overall_likelihood", "stolen",
+}
+
+US_REGIONS = {
+    "Northeast": ["CT", "ME", "MA", "NH", "RI", "VT", "NJ", "NY", "PA"],
+    "Midwest":   ["IL", "IN", "MI", "OH", "WI", "IA", "KS", "MN", "MO", "NE", "ND", "SD"],
+    "South":     ["DE", "FL", "GA", "MD", "NC", "SC", "VA", "DC", "WV", "AL", "KY", "MS", "TN", "AR", "LA", "OK", "TX"],
+    "West":      ["AZ", "CO", "ID", "MT", "NV", "NM", "UT", "WY", "AK", "CA", "HI", "OR", "WA"],
+}
+REGION_OF_STATE = {state: region for region, states in US_REGIONS.items() for state in states}
+
+# binary_flag spellings, after lowercasing and stripping
+BINARY_VALUES = {
+    "1": 1, "1.0": 1, "true": 1, "yes": 1, "y": 1, "t": 1,
+    "0": 0, "0.0": 0, "false": 0, "no": 0, "n": 0, "f": 0,
+}
+
+# Columns whose flagged counts the page charts
+COUNTED_COLUMNS = ["region", "state_abbr", "location"]
+
+# Thresholds of the page's slider; a listing is flagged when its score is at or above one
+THRESHOLDS = np.arange(1, 11)
+
+MAX_CACHED_RESULTS = 4
+
+
+def to_binary(values, missing=0.0):
+    """Vectorized binary_flag -> 1/0: missing is `missing`, truthy/falsy spellings map, anything else is NaN."""
+    text = values.astype("string").str.strip().str.lower()
+    mapped = text.map(BINARY_VALUES).astype(float)
+    return mapped.where(values.notna(), missing)
+
+
+def threshold_sweep(scores, labels):
+    """
+    Confusion counts and metrics at every threshold in THRESHOLDS, for listings with a
+    manual label (1/0); unscored listings count as not flagged. Returns a DataFrame
+    indexed by threshold with tp, fp, fn, tn, precision, recall, f1 and fpr.
+    """
+    labeled = ~np.isnan(labels)
+    scores, labels = scores[labeled], labels[labeled]
+    # Bin b holds the scores flagged up to threshold b: floor(score), clipped to 0..max threshold
+    bins = np.clip(np.floor(np.nan_to_num(scores, nan=0)), 0, THRESHOLDS[-1]).astype(int)
+    positives = np.bincount(bins[labels == 1], minlength=THRESHOLDS[-1] + 1)
+    negatives = np.bincount(bins[labels == 0], minlength=THRESHOLDS[-1] + 1)
+
+    # Flagged at threshold t = listings in bins t and up
+    tp = positives[::-1].cumsum()[::-1][THRESHOLDS]
+    fp = negatives[::-1].cumsum()[::-1][THRESHOLDS]
+    fn = positives.sum() - tp
+    tn = negatives.sum() - fp
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = tp / (tp + fp)
+        recall = tp / (tp + fn)
+        f1 = 2 * tp / (2 * tp + fp + fn)
+        fpr = fp / (fp + tn)
+    return pd.DataFrame(
+        {"tp": tp, "fp": fp, "fn": fn, "tn": tn, "precision": precision, "recall": recall, "f1": f1, "fpr": fpr},
+        index=pd.Index(THRESHOLDS, name="threshold"),
+    )
+
+
+def area_under(x, y):
+    """Trapezoid area under the points (x, y), taken in order of x."""
+    order = np.argsort(x, kind="stable")
+    x, y = np.asarray(x)[order], np.asarray(y)[order]
+    return float(np.sum((x[1:] - x[:-1]) * (y[1:] + y[:-1]) / 2))
+
+
+class Results:
+    def __init__(self, frame):
+        self.missing_columns = sorted((REQUIRED_COLUMNS | AI_LABEL_COLUMNS) - set(frame.columns))
+        for col in self.missing_columns:
+            if col == "overall_likelihood":
+                frame[col] = np.random.randint(1, 11, size=len(frame))  # Random int from 1 to 10
+            else:
+                frame[col] = np.nan
+
+        self.has_manual_label = "binary_flag" in frame.columns
+        frame["overall_likelihood"] = pd.to_numeric(frame["overall_likelihood"], errors="coerce")
+        if self.has_manual_label:
+            # Unlabeled listings stay NaN, so the sweep and the page's tables leave them out
+            frame["manual_binary"] = to_binary(frame["binary_flag"], missing=np.nan)
+
+        location = frame["location"].astype("string")
+        state = location.str.extract(r",\s*([A-Z]{2})", expand=False)
+        frame["state_abbr"] = state.astype("category")
+        frame["region"] = state.map(REGION_OF_STATE).fillna("Other").astype("category")
+        frame["location"] = location.astype("category")
+        self.frame = frame
+
+        self.scores = frame["overall_likelihood"].to_numpy()
+        self.score_counts = frame["overall_likelihood"].value_counts().sort_index()
+        # column -> listing counts per (score, value); unscored listings are never flagged
+        self._counts = {
+            col: frame.groupby(["overall_likelihood", col], observed=True).size().unstack(fill_value=0)
+            for col in COUNTED_COLUMNS
+        }
+
+        self.sweep = None
+        self.best_threshold = None
+        if self.has_manual_label:
+            self.sweep = threshold_sweep(self.scores.astype(float), frame["manual_binary"].to_numpy(dtype=float))
+            if self.sweep["f1"].notna().any():
+                self.best_threshold = int(self.sweep["f1"].idxmax())
+
+    def roc_curve(self):
+        """False/true positive rates at every threshold, with the (0, 0) and (1, 1) ends."""
+        fpr = np.concatenate([[1.0], self.sweep["fpr"].to_numpy(), [0.0]])
+        tpr = np.concatenate([[1.0], self.sweep["recall"].to_numpy(), [0.0]])
+        curve = pd.DataFrame({"threshold": [0, *THRESHOLDS, THRESHOLDS[-1] + 1], "fpr": fpr, "tpr": tpr})
+        return curve.dropna()
+
+    def pr_curve(self):
+        """Recall and precision at every threshold that flags at least one labeled listing."""
+        curve = self.sweep[["recall", "precision"]].reset_index()
+        return curve.dropna()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def flagged(self, threshold):
+        """Boolean mask of the listings the AI flags at `threshold`."""
+        return self.scores >= threshold
+
+    def flagged_counts(self, column, threshold):
+        """Flagged listings per value of `column`, largest first, without the zeros."""
+        counts = self._counts[column]
+        counts = counts[counts.index >= threshold].sum()
+        return counts[counts > 0].sort_values(ascending=False)
+
+
+# --- Process-wide caches by content, shared by every session ---
+_results = OrderedDict()
+_reports = OrderedDict()
+# upload file_id -> content hash, for the latest uploads
+_hashes = OrderedDict()
+_lock = threading.Lock()
+
+
+def content_hash(uploaded_file):
+    """SHA-1 of an upload's bytes, computed once per upload."""
+    file_id = getattr(uploaded_file, "file_id", None)
+    with _lock:
+        if file_id is not None and file_id in _hashes:
+            return _hashes[file_id]
+    digest = hashlib.sha1(uploaded_file.getvalue()).hexdigest()
+    if file_id is not None:
+        with _lock:
+            _hashes[file_id] = digest
+            while len(_hashes) > 64:
+                _hashes.popitem(last=False)
+    return digest
+
+
+def _cached(cache, uploaded_file, build):
+    key = content_hash(uploaded_file)
+    with _lock:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+    uploaded_file.seek(0)
+    value = build(uploaded_file)
+    uploaded_file.seek(0)
+    with _lock:
+        cache[key] = value
+        while len(cache) > MAX_CACHED_RESULTS:
+            cache.popitem(last=False)
+    return value
+
+
+def validation_report(uploaded_file):
+    """csv_validation report of an uploaded CSV, checked once per content."""
+    return _cached(_reports, uploaded_file, cv.validate)
+
+
+def load(uploaded_file):
+    """The Results of an uploaded CSV, parsed once per content. Treat the frame as read-only."""
+    return _cached(_results, uploaded_file, lambda f: Results(pd.read_csv(f)))
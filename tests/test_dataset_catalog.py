@@ -0,0 +1,76 @@
+# test_dataset_catalog.py
+# -----------
+# Offline checks of the dataset catalog against fake_drive.FakeDrive: a labeled
+# copy deleted from Drive after the catalog recorded it.
+
+import pandas as pd
+import pytest
+import dataset_catalog as dc
+import drive_utils as du
+from fake_drive import FakeDrive
+
+DATASET = "Small_Town_ca_50mi.csv"
+
+
+@pytest.fixture
+def drive(tmp_path, monkeypatch):
+    monkeypatch.setattr(dc, "CATALOG_PATH", str(tmp_path / "catalog.json"))
+    monkeypatch.setattr(dc, "_catalog", None)
+    drive = FakeDrive()
+    du.use_service_factory(drive.service)
+    yield drive
+    du.use_service_factory(None)
+
+
+@pytest.fixture
+def entry(tmp_path, drive):
+    folder = tmp_path / "Data" / "2025_07_24"
+    images = folder / DATASET.replace(".csv", "_files")
+    images.mkdir(parents=True)
+    for i in range(3):
+        (images / f"{i}.jpg").write_bytes(b"\xff\xd8\xff\xd9")
+    pd.DataFrame({
+        "listing_url": [f"https://example.com/{i}" for i in range(3)],
+        "photo_url": [f"files/{i}.jpg" for i in range(3)],
+        "price": "$20",
+    }).to_csv(folder / DATASET, index=False)
+
+    root_id = drive.add_folder("LabelingAppData")
+    local = dc.scan_data_folder(str(tmp_path / "Data"))
+    [entry] = dc.iter_refresh(root_id, local=local)
+    return entry
+
+
+def labeled(entry, flag):
+    df = dc.load_frame(entry)
+    df["binary_flag"] = flag
+    return df
+
+
+def save(entry, df):
+    sel = {"drive_file": entry["file"], "drive_folder_id": entry["drive_folder_id"], "catalog_key": entry["key"]}
+    dc.save_labels(df, sel)
+    return dc.get_entry(entry["key"])
+
+
+def test_deleted_copy_falls_back_to_legacy_csv(drive, entry):
+    du.upload_csv(labeled(entry, "No"), DATASET, entry["drive_folder_id"])
+    stored = save(entry, labeled(entry, "Yes"))
+    assert stored["stored_format"] == "parquet"
+    del drive.files[stored["stored_file_id"]]
+
+    df = dc.load_frame(stored)
+
+    assert df["binary_flag"].tolist() == ["No"] * 3
+    assert dc.get_entry(entry["key"])["stored_file"] == DATASET
+
+
+def test_deleted_copy_falls_back_to_local_csv(drive, entry):
+    stored = save(entry, labeled(entry, "Yes"))
+    del drive.files[stored["stored_file_id"]]
+
+    df = dc.load_frame(stored)
+
+    assert df["binary_flag"].isna().all()
+    assert df["image_exist"].all()
+    assert dc.get_entry(entry["key"])["stored_file_id"] is None
@@ -0,0 +1,88 @@
+# test_fake_drive.py
+# -----------
+# Offline checks of drive_utils against fake_drive.FakeDrive: batched folder
+# lookups, retries and per-item errors of execute_batch, and a dataset
+# upload/download round trip, with their request counts.
+
+import pandas as pd
+import pytest
+import drive_utils as du
+from fake_drive import FakeDrive
+
+
+@pytest.fixture
+def drive():
+    drive = FakeDrive()
+    du.use_service_factory(drive.service)
+    yield drive
+    du.use_service_factory(None)
+
+
+def test_batch_resolve_folder_ids(drive):
+    root_id = drive.add_folder("LabelingAppData")
+    existing_id = drive.add_folder("2025_07_24", root_id)
+
+    folder_ids = du.batch_resolve_folder_ids(["2025_07_24", "2025_08_01"], root_id)
+
+    assert folder_ids["2025_07_24"] == existing_id
+    assert drive.files[folder_ids["2025_08_01"]]["parents"] == [root_id]
+    # One lookup batch, one create batch
+    assert drive.round_trips == 2
+
+
+def test_dataset_round_trip(drive):
+    folder_id = drive.add_folder("2025_07_24")
+    df = pd.DataFrame({
+        "listing_url": ["https://example.com/1", "https://example.com/2"],
+        "price": ["$20", "Free"],
+        "binary_flag": ["Yes", None],
+    })
+
+    du.save_dataset(df, "National_Coverage.csv", folder_id)
+    # One name lookup, one upload
+    assert drive.round_trips == 2
+
+    drive.round_trips = 0
+    loaded = du.load_dataset("National_Coverage.csv", folder_id)
+    # One batch resolving the stored file, one download
+    assert drive.round_trips == 2
+    pd.testing.assert_frame_equal(loaded, df)
+
+
+def lookups(names):
+    return {name: (lambda service, name=name: service.files().list(q=f"name='{name}'")) for name in names}
+
+
+def test_rate_limited_item_is_retried(drive):
+    folder_ids = {name: drive.add_folder(name) for name in ("a", "b")}
+    drive.fail("a", 429)
+
+    responses, errors = du.execute_batch(lookups(folder_ids), delay=0)
+
+    assert errors == {}
+    assert {name: response["files"][0]["id"] for name, response in responses.items()} == folder_ids
+    # The first batch, then "a" on its own
+    assert drive.round_trips == 2
+
+
+def test_missing_item_is_reported_without_retry(drive):
+    drive.add_folder("b")
+    drive.fail("a", 404, 404)
+
+    responses, errors = du.execute_batch(lookups(["a", "b"]), delay=0)
+
+    assert errors["a"].resp.status == 404
+    assert list(responses) == ["b"]
+    assert drive.round_trips == 1
+
+
+def test_large_batch_is_split_at_the_batch_limit(drive):
+    names = [f"folder_{i}" for i in range(150)]
+    for name in names:
+        drive.add_folder(name)
+
+    responses, errors = du.execute_batch(lookups(names), delay=0)
+
+    assert errors == {}
+    assert len(responses) == 150
+    assert drive.round_trips == 2
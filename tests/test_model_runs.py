@@ -0,0 +1,123 @@
+# test_model_runs.py
+# -----------
+# Two model runs at once on the shared scheduler, against an in-memory stand-in
+# for the Gemini SDK that reads the process-wide key as late as the real one
+# does: every request must go out under the key Scheduler.acquire() gave it.
+
+import os
+import sys
+import threading
+import time
+import types
+import pandas as pd
+import pytest
+import model_runs
+
+API_KEYS = ["key-0", "key-1"]
+
+
+class FakeGenAI:
+    def __init__(self):
+        self.configured = None
+        # (listing title, key the request was sent with)
+        self.requests = []
+        self._lock = threading.Lock()
+        genai = self
+
+        class GenerativeModel:
+            def __init__(self, model_name):
+                self._client = None
+
+            def generate_content(self, contents):
+                client = self._client
+                # Without a client of its own, the request picks up whatever key is configured when it is sent
+                time.sleep(0.005)
+                key = client.key if client is not None else genai.configured
+                title = contents[1]["text"].split("|")[0]
+                with genai._lock:
+                    genai.requests.append((title, key))
+                return types.SimpleNamespace(text="Overall likelihood shoplifted: 3\nStolen: no")
+
+        self.GenerativeModel = GenerativeModel
+
+    def configure(self, api_key):
+        self.configured = api_key
+
+    def module(self):
+        genai = types.ModuleType("google.generativeai")
+        genai.configure = self.configure
+        genai.GenerativeModel = self.GenerativeModel
+        genai.client = types.ModuleType("google.generativeai.client")
+        genai.client.get_default_generative_client = lambda: types.SimpleNamespace(key=self.configured)
+        return genai
+
+
+@pytest.fixture
+def fake_sdk(monkeypatch):
+    fake = FakeGenAI()
+    genai = fake.module()
+    config = types.ModuleType("AI_Model_Files.config")
+    config.API_KEYS = API_KEYS
+    config.VISION_MODELS = ["fake-vision"]
+    config.PROMPT_TEMPLATE = "{title}|{category}|{price}"
+    config.TOKENIZER_NAME = "fake"
+    config.DELAY_SECONDS = 0
+    tiktoken = types.ModuleType("tiktoken")
+    tiktoken.get_encoding = lambda name: types.SimpleNamespace(encode=lambda text: text.split())
+
+    monkeypatch.setitem(sys.modules, "google.generativeai", genai)
+    monkeypatch.setitem(sys.modules, "google.generativeai.client", genai.client)
+    monkeypatch.setitem(sys.modules, "AI_Model_Files.config", config)
+    monkeypatch.setitem(sys.modules, "tiktoken", tiktoken)
+    monkeypatch.delitem(sys.modules, "AI_Model_Files.label_Machine_test", raising=False)
+    monkeypatch.setattr(model_runs, "REQUESTS_PER_KEY_PER_MINUTE", 60_000)
+    yield fake
+    sys.modules.pop("AI_Model_Files.label_Machine_test", None)
+
+
+def write_run_inputs(folder, prefix, rows):
+    images = os.path.join(folder, "images")
+    os.makedirs(images, exist_ok=True)
+    listings = []
+    for i in range(rows):
+        name = f"{prefix}_{i}.jpg"
+        with open(os.path.join(images, name), "wb") as f:
+            f.write(b"\xff\xd8\xff\xd9")
+        listings.append({
+            "listing_url": f"https://example.com/{prefix}/{i}", "photo_url": f"files/{name}",
+            "title": f"{prefix}-{i}", "category": "tools", "price": "$20",
+        })
+    input_csv = os.path.join(folder, f"{prefix}.csv")
+    pd.DataFrame(listings).to_csv(input_csv, index=False)
+    return input_csv, images, os.path.join(folder, f"{prefix}_model_results.csv")
+
+
+def test_concurrent_runs_send_requests_with_their_acquired_keys(fake_sdk, tmp_path):
+    scheduler = model_runs.Scheduler(pool_size=len(API_KEYS))
+    # Title prefix -> keys handed out by acquire(), in order
+    acquired = {"A": [], "B": []}
+    acquire = scheduler.acquire
+
+    def recording_acquire(job):
+        key_index = acquire(job)
+        acquired[job.user].append(API_KEYS[key_index])
+        return key_index
+
+    scheduler.acquire = recording_acquire
+
+    jobs = []
+    for user in ("A", "B"):
+        input_csv, images, result_path = write_run_inputs(str(tmp_path), user, rows=20)
+        jobs.append(scheduler.submit(model_runs.Job(user, input_csv, images, result_path, max_to_process=20)))
+
+    deadline = time.monotonic() + 30
+    while any(job.active for job in jobs) and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert [job.status for job in jobs] == ["finished", "finished"]
+    assert all(job.done == 20 for job in jobs)
+    for user in ("A", "B"):
+        sent = [key for title, key in fake_sdk.requests if title.startswith(f"{user}-")]
+        assert sent == acquired[user]
+    # Both keys were in use while both runs were
+    assert set(acquired["A"] + acquired["B"]) == set(API_KEYS)
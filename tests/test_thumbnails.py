@@ -0,0 +1,51 @@
+# test_thumbnails.py
+# -----------
+# Thumbnails of broken images: the labeling grid falls back to the original
+# bytes instead of failing the page.
+
+import base64
+import io
+import os
+import pytest
+from PIL import Image
+import thumbnails as th
+
+
+@pytest.fixture(autouse=True)
+def thumbnail_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(th, "THUMBNAIL_DIR", str(tmp_path / "thumbnails"))
+
+
+def jpeg_bytes(size=(640, 480)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size, "red").save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_thumbnail_is_resized(tmp_path):
+    path = th.thumbnail_path(write(tmp_path, "photo.jpg", jpeg_bytes()))
+    with Image.open(path) as img:
+        assert img.format == "WEBP"
+        assert max(img.size) == th.THUMBNAIL_SIZE
+
+
+@pytest.mark.parametrize("data, mime", [
+    (jpeg_bytes()[:2000], "image/jpeg"),  # cut-off download
+    (b"<html>not an image</html>", "image/jpeg"),
+])
+def test_broken_image_is_inlined_as_is(tmp_path, data, mime):
+    image_path = write(tmp_path, "broken.jpg", data)
+    with pytest.raises(OSError):
+        th.thumbnail_path(image_path)
+
+    src = th.thumbnail_src(image_path)
+
+    assert src.startswith(f"data:{mime};base64,")
+    assert base64.b64decode(src.split(",", 1)[1]) == data
+    assert not os.listdir(th.THUMBNAIL_DIR)
@@ -0,0 +1,182 @@
+# thumbnails.py
+# -----------
+# Thumbnails for the labeling grid. Each source image is resized once into a
+# content-addressed WebP file (static/thumbnails/<sha1 of the image>.webp), so
+# identical images across datasets share one thumbnail and a changed image gets
+# a new one. Cards then reference the thumbnail by URL:
+#
+#   - with server.enableStaticServing (see .streamlit/config.toml) the browser
+#     loads app/static/thumbnails/<sha1>.webp and caches it, so reruns send no
+#     image bytes at all;
+#   - otherwise the thumbnail is inlined as a data URI, built from an in-memory
+#     LRU instead of re-reading and re-encoding the file on every rerun.
+#
+# Files Pillow cannot thumbnail (truncated, not an image) are inlined as they
+# are, as the page did before thumbnails, instead of failing the page.
+#
+# prefetch() does the same work on a small background pool, so the thumbnails
+# of upcoming pages are ready before they are shown. perceptual_hash() gives
+# near-identical images (re-encoded or resized reposts) the same 64-bit hash.
+
+import base64
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+import streamlit as st
+import image_integrity as integ
+
+STATIC_DIR = os.path.join(os.getcwd(), "static")
+THUMBNAIL_DIR = os.path.join(STATIC_DIR, "thumbnails")
+STATIC_URL = "app/static/thumbnails"
+
+# Longest side in pixels: a grid card is ~1/5 of a wide page, doubled for high-DPI screens
+THUMBNAIL_SIZE = 400
+THUMBNAIL_QUALITY = 80
+MAX_CACHED_URIS = 512
+
+# Side of the grayscale grid compared by the difference hash (PHASH_SIZE ** 2 bits)
+PHASH_SIZE = 8
+
+# Background threads warming thumbnails; image reads on a network-mounted Data/ dominate
+PREFETCH_WORKERS = 4
+
+_lock = threading.Lock()
+# (path, mtime_ns, size) -> content hash, so a known file is never re-read
+_digests = {}
+_data_uris = OrderedDict()
+_phashes = {}
+_prefetching = set()
+_prefetch_executor = None
+
+
+def _digest(image_path):
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        digest = _digests.get(key)
+    if digest is None:
+        with open(image_path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        with _lock:
+            _digests[key] = digest
+    return digest
+
+
+def perceptual_hash(image_path):
+    """Difference hash (dHash) of an image as a hex string, cached per file version."""
+    stat = os.stat(image_path)
+    key = (image_path, stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        phash = _phashes.get(key)
+    if phash is None:
+        with Image.open(image_path) as img:
+            gray = ImageOps.exif_transpose(img).convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.Resampling.LANCZOS)
+        pixels = list(gray.getdata())
+        bits = 0
+        for row in range(PHASH_SIZE):
+            for col in range(PHASH_SIZE):
+                left = pixels[row * (PHASH_SIZE + 1) + col]
+                bits = (bits << 1) | (left > pixels[row * (PHASH_SIZE + 1) + col + 1])
+        phash = f"{bits:0{PHASH_SIZE * PHASH_SIZE // 4}x}"
+        with _lock:
+            _phashes[key] = phash
+    return phash
+
+
+def thumbnail_path(image_path):
+    """Path of the thumbnail for `image_path`, generating it on first use."""
+    digest = _digest(image_path)
+    path = os.path.join(THUMBNAIL_DIR, f"{digest}.webp")
+    if not os.path.exists(path):
+        os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+        with Image.open(image_path) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGB")
+            # Write under a unique name first so concurrent sessions never see a partial file
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, format="WEBP", quality=THUMBNAIL_QUALITY)
+        os.replace(tmp_path, path)
+    return path
+
+
+def _data_uri(path):
+    with _lock:
+        uri = _data_uris.get(path)
+        if uri is not None:
+            _data_uris.move_to_end(path)
+            return uri
+    with open(path, "rb") as f:
+        uri = f"data:image/webp;base64,{base64.b64encode(f.read()).decode()}"
+    with _lock:
+        _data_uris[path] = uri
+        while len(_data_uris) > MAX_CACHED_URIS:
+            _data_uris.popitem(last=False)
+    return uri
+
+
+def _raw_data_uri(image_path):
+    with _lock:
+        uri = _data_uris.get(image_path)
+        if uri is not None:
+            _data_uris.move_to_end(image_path)
+            return uri
+    with open(image_path, "rb") as f:
+        data = f.read()
+    uri = f"data:{integ.mime_type(data)};base64,{base64.b64encode(data).decode()}"
+    with _lock:
+        _data_uris[image_path] = uri
+        while len(_data_uris) > MAX_CACHED_URIS:
+            _data_uris.popitem(last=False)
+    return uri
+
+
+def static_serving_enabled():
+    try:
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+
+def thumbnail_src(image_path):
+    """
+    Value for an <img src>: a cacheable static URL when possible, otherwise a data URI.
+    An image that cannot be thumbnailed is inlined with its original bytes.
+    """
+    try:
+        path = thumbnail_path(image_path)
+    except (OSError, Image.DecompressionBombError) as e:
+        print(f"Could not make a thumbnail of {image_path}: {e}")
+        return _raw_data_uri(image_path)
+    if static_serving_enabled():
+        return f"{STATIC_URL}/{os.path.basename(path)}"
+    return _data_uri(path)
+
+
+def _warm(image_path, inline):
+    try:
+        path = thumbnail_path(image_path)
+        if inline:
+            _data_uri(path)
+    except Exception as e:
+        print(f"Could not prefetch thumbnail for {image_path}: {e}")
+    finally:
+        with _lock:
+            _prefetching.discard(image_path)
+
+
+def prefetch(image_paths):
+    """Generate the thumbnails of `image_paths` (and load their data URIs if needed) in the background."""
+    global _prefetch_executor
+    inline = not static_serving_enabled()
+    with _lock:
+        if _prefetch_executor is None:
+            _prefetch_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="thumbnails")
+        paths = [p for p in image_paths if isinstance(p, str) and p not in _prefetching]
+        _prefetching.update(paths)
+    for path in paths:
+        _prefetch_executor.submit(_warm, path, inline)
@@ -0,0 +1,191 @@
+# upload_manifest.py
+# -----------
+# Per-user summary of the AI tool's uploads in uploaded_data/<user>/, so that a
+# rerun of the AI-Tool page only lists and stat()s the folder instead of
+# re-reading CSVs and re-indexing images. Each part is cached under the
+# [mtime_ns, size] stamp of the file it describes and rebuilt only when that
+# changes:
+#
+#   {
+#     "csv":    {"name", "path", "stamp", "rows", "columns", "missing_columns", "error", "issues", "issue_count", "photo_urls"},
+#     "zip":    {"name", "path", "stamp"},
+#     "result": {"name", "path", "stamp", "rows"},
+#     "images": {"path", "stamp", "source", "count", "error"},  # extracted_images/ if present, else the ZIP
+#     "match":  {"stamp", "matched", "total", "missing"},  # missing: photo_urls without an image
+#   }
+#
+# A part is None when its file does not exist. get_integrity() adds the slower
+# per-image check of the images (see image_integrity.py), cached the same way.
+# It runs on a background thread, so reruns of the page are not held up; until
+# it finishes the part only has "pending": True:
+#
+#   {"path", "stamp", "pending", "error", "files", "unusable", "mismatched"}  # DataFrames of image_integrity.COLUMNS
+
+import os
+import threading
+import zipfile
+import pandas as pd
+import image_source as isrc
+import csv_validation as cv
+import image_integrity as integ
+
+REQUIRED_COLUMNS = {"photo_url", "price", "title", "location", "origin_city_list"}
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+EXTRACTED_FOLDER = "extracted_images"
+
+_lock = threading.Lock()
+# abspath of a user's folder -> {part name: part}
+_manifests = {}
+_folder_locks = {}
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _csv_part(path):
+    # Rejected on the header alone when columns are missing; otherwise only the checked columns are read
+    report = cv.validate(path, REQUIRED_COLUMNS, keep=["photo_url"])
+    values = report["values"]
+    return {
+        "rows": report["rows"],
+        "columns": report["columns"],
+        "missing_columns": report["missing_columns"],
+        "error": report["error"],
+        "issues": cv.issues_frame(report),
+        "issue_count": report["issue_count"],
+        "photo_urls": values["photo_url"] if values is not None and "photo_url" in values.columns else None,
+    }
+
+
+def _result_part(path):
+    # Only the row count is needed; one column keeps the parse cheap
+    try:
+        rows = len(pd.read_csv(path, usecols=lambda col: col == "listing_url"))
+    except Exception as e:
+        print(f"Could not read results file {path}: {e}")
+        rows = 0
+    return {"rows": rows}
+
+
+def _images_part(path):
+    try:
+        source = isrc.get_source(path, extensions=IMAGE_EXTENSIONS)
+    except zipfile.BadZipFile as e:
+        return {"source": None, "count": 0, "error": str(e)}
+    return {"source": source, "count": len(source), "error": None}
+
+
+def _match_part(photo_urls, source):
+    exists = source.exists(photo_urls)
+    missing = pd.DataFrame({
+        "photo_url": photo_urls[~exists],
+        "image_filename": photo_urls[~exists].apply(lambda x: os.path.basename(x).strip() if isinstance(x, str) and x else ""),
+    })
+    return {"matched": int(exists.sum()), "total": len(photo_urls), "missing": missing}
+
+
+def _part(cache, name, path, stamp, build):
+    part = cache.get(name)
+    if part is None or part["stamp"] != stamp or part.get("path") != path:
+        part = dict(build(), path=path, stamp=stamp)
+        cache[name] = part
+    return part
+
+
+def _folder(base_path):
+    # The cache and lock of a user's folder
+    with _lock:
+        key = os.path.abspath(base_path)
+        return _manifests.setdefault(key, {}), _folder_locks.setdefault(key, threading.Lock())
+
+
+def get_manifest(base_path):
+    """The manifest of a user's upload folder, rebuilding only the parts whose files changed."""
+    files = sorted(os.listdir(base_path))
+    csvs = [f for f in files if f.endswith(".csv") and "model_results" not in f]
+    zips = [f for f in files if f.endswith(".zip")]
+    results = [f for f in files if f.endswith(".csv") and "model_results" in f]
+    extracted = os.path.join(base_path, EXTRACTED_FOLDER)
+
+    cache, folder_lock = _folder(base_path)
+
+    # Reruns of one user's page wait for each other; other users are not held up
+    with folder_lock:
+        manifest = {}
+        for name, found, build in (
+            ("csv", csvs, _csv_part),
+            ("zip", zips, lambda path: {}),
+            ("result", results, _result_part),
+        ):
+            if found:
+                path = os.path.join(base_path, found[0])
+                manifest[name] = dict(_part(cache, name, path, _stamp(path), lambda: build(path)), name=found[0])
+            else:
+                manifest[name] = None
+
+        # The model reads images from a previous extraction if there is one, otherwise from the ZIP
+        images_path = None
+        if os.path.isdir(extracted) and os.listdir(extracted):
+            images_path = extracted
+        elif manifest["zip"] is not None:
+            images_path = manifest["zip"]["path"]
+        manifest["images"] = None
+        if images_path is not None:
+            manifest["images"] = _part(cache, "images", images_path, _stamp(images_path), lambda: _images_part(images_path))
+
+        manifest["match"] = None
+        csv, images = manifest["csv"], manifest["images"]
+        if csv is not None and csv["photo_urls"] is not None and images is not None and images["source"] is not None:
+            stamp = [csv["stamp"], images["stamp"], images["path"]]
+            manifest["match"] = _part(cache, "match", None, stamp, lambda: _match_part(csv["photo_urls"], images["source"]))
+    return manifest
+
+
+def _integrity_part(source):
+    try:
+        files = integ.check_source(source)
+        error = None
+    except Exception as e:
+        print(f"Could not check images in {source.path}: {e}")
+        files = pd.DataFrame(columns=integ.COLUMNS).astype({"usable": bool})
+        error = str(e)
+    return {
+        "pending": False,
+        "error": error,
+        "files": files,
+        "unusable": files[~files["usable"]],
+        "mismatched": files[files["usable"] & files["problem"].notna()],
+    }
+
+
+def _check_images(cache, folder_lock, path, stamp, source):
+    part = dict(_integrity_part(source), path=path, stamp=stamp)
+    with folder_lock:
+        # Kept only if the images did not change while they were checked
+        current = cache.get("integrity")
+        if current is not None and current["path"] == path and current["stamp"] == stamp:
+            cache["integrity"] = part
+
+
+def get_integrity(base_path, manifest):
+    """
+    Integrity records of the manifest's images, checked once per version of the ZIP or
+    folder on a background thread. Returns the pending part while the check runs.
+    """
+    images = manifest["images"]
+    if images is None or images["source"] is None:
+        return None
+    path, stamp = images["path"], images["stamp"]
+    cache, folder_lock = _folder(base_path)
+    with folder_lock:
+        part = cache.get("integrity")
+        if part is None or part["stamp"] != stamp or part["path"] != path:
+            part = {"path": path, "stamp": stamp, "pending": True}
+            cache["integrity"] = part
+            threading.Thread(
+                target=_check_images, args=(cache, folder_lock, path, stamp, images["source"]),
+                name=f"image-check-{os.path.basename(base_path)}", daemon=True,
+            ).start()
+        return part